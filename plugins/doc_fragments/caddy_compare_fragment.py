@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+    DOCUMENTATION = r'''
+    options:
+      ignore_paths:
+        description:
+          - Config paths that are ignored when comparing the running configuration to the desired one,
+            for example values that are managed elsewhere. A path segment of C(*) matches any key or array index,
+            such as C(apps/http/servers/*/metrics).
+          - Ignored values are not written on their own, but they are still overwritten
+            if other changes require pushing an object that contains them.
+        type: list
+        elements: str
+        default: []
+        version_added: '6.2.0'
+      unordered_paths:
+        description: >
+          Config paths of arrays whose order does not matter, such as C(apps/http/servers/*/listen).
+          Arrays that only differ in the order of their items are considered equal.
+          A path segment of C(*) matches any key or array index.
+        type: list
+        elements: str
+        default: []
+        version_added: '6.2.0'
+      normalize:
+        description:
+          - Whether to compare configurations the way Caddy interprets them, instead of value by value.
+          - Object members that are false, 0, empty strings or empty arrays are treated like missing ones.
+            Members that are empty objects are kept, as their key may be meaningful on its own,
+            such as the C(gzip) object in the C(encodings) of an C(encode) handler.
+          - Duration strings such as C(1m) are considered equal to their value in nanoseconds,
+            but only in the duration fields of the standard Caddy modules, such as C(idle_timeout) or C(dial_timeout).
+          - This prevents changes, and with them reloads of the entire Caddy configuration,
+            when the running configuration merely looks different from the desired one.
+            As it relies on how Caddy's config structs treat empty values, it is only safe to enable
+            if the configuration does not contain modules that give meaning to them.
+          - Members that are null are always treated like missing ones.
+        type: bool
+        default: no
+        version_added: '6.2.0'
+    '''
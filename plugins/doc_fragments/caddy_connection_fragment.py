@@ -9,15 +9,34 @@ __metaclass__ = type
 
 class ModuleDocFragment(object):
     DOCUMENTATION = r'''
-    requirements:
-      - C(requests) must be installed on the host executing the query
     options:
       caddy_host:
-        description: Address of the caddy API endpoint
+        description: >
+          Address of the caddy API endpoint. If no scheme is given, C(http://) is assumed.
+          Use C(unix:///path/to/admin.sock) to connect to an admin endpoint listening on a unix socket.
+          Ignored when running through the P(maxhoesel.caddy.caddy#httpapi) plugin.
         default: "http://localhost:2019"
         type: str
       timeout:
-        description: Timeout for connections to the caddy API in seconds
+        description: >
+          Timeout for connections to the caddy API in seconds.
+          When running through the P(maxhoesel.caddy.caddy#httpapi) plugin, C(ansible_command_timeout) is used instead.
         default: 30
         type: int
+      api_trace:
+        description: >
+          Whether to return every request made to the Caddy API in I(caddy_api_trace),
+          with its status, duration, body sizes and whether it reused an open connection.
+        default: no
+        type: bool
+        version_added: '6.2.0'
+      profile_file:
+        description:
+          - Path of a file on the managed node to which the timings of the module run are appended, as one line of JSON per run.
+          - Each line contains the time spent on starting the module process including all imports (C(startup)),
+            argument parsing, reading the configuration from the API (C(fetch)),
+            comparing it (C(compare)) and writing changes (C(write)), along with the I(caddy_api_stats).
+          - Only successful runs against a single Caddy host are recorded.
+        type: path
+        version_added: '6.2.0'
     '''
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+author: Max Hösel (@maxhoesel)
+name: caddy
+short_description: HttpApi plugin for the Caddy admin API
+version_added: '6.2.0'
+description:
+  - Lets the modules in this collection run on the controller and reach the Caddy admin API
+    through a persistent C(ansible.netcommon.httpapi) connection.
+  - The connection plugin process is kept for all tasks of a play, so tasks don't need to copy and start
+    a module on the Caddy host.
+  - The plugin keeps a single HTTP connection to the admin API open for all requests of the play,
+    and only opens a new one if Caddy closed it. The I(caddy_api_stats) returned by the modules reflect this.
+  - Requests are sent over this connection directly instead of through C(ansible.netcommon.httpapi),
+    so the C(ansible_httpapi_use_proxy), C(ansible_httpapi_ciphers) options and authentication are not used.
+    C(ansible_httpapi_use_ssl), C(ansible_httpapi_validate_certs), C(ansible_httpapi_ca_path),
+    C(ansible_httpapi_client_cert), C(ansible_httpapi_client_key) and C(persistent_command_timeout) apply as usual.
+  - Set C(ansible_connection=ansible.netcommon.httpapi), C(ansible_network_os=maxhoesel.caddy.caddy)
+    and C(ansible_httpapi_port) to the port of the admin API (usually C(2019)).
+    The admin API must be reachable from the controller.
+  - When using this plugin, the I(caddy_host) option of the modules is ignored.
+"""
+
+import socket
+import ssl
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+
+from ansible_collections.ansible.netcommon.plugins.plugin_utils.httpapi_base import HttpApiBase
+
+
+class HttpApi(HttpApiBase):
+
+    def __init__(self, connection):
+        super(HttpApi, self).__init__(connection)
+        self._conn = None
+
+    def handle_httperror(self, exc):
+        # Caddy reports errors with a JSON body that the modules interpret themselves
+        return exc
+
+    def logout(self):
+        self._close()
+
+    def send_request(self, data, path="/", method="GET", headers=None):
+        """
+        Sends a request to the Caddy API over the kept-alive connection.
+        data is the serialized request body (or None).
+        If the connection was closed by Caddy while idle, the request is sent again over a new one.
+
+        Returns a tuple (status_code, reason, headers, body, reused), where header names are lowercase,
+        body is the response body as text and reused tells whether the request was sent over an already open connection.
+        Raises AnsibleConnectionFailure if the request could not be sent.
+        """
+        body = to_bytes(data) if data is not None else None
+        headers = headers or {}
+        reused = self._conn is not None
+        try:
+            try:
+                if not reused:
+                    self._conn = self._connect()
+                response = self._request(method, path, body, headers)
+            except (HTTPException, socket.error):
+                self._close()
+                if not reused:
+                    raise
+                reused = False
+                self._conn = self._connect()
+                response = self._request(method, path, body, headers)
+        except (HTTPException, socket.error) as e:
+            self._close()
+            raise AnsibleConnectionFailure("Could not send request to {url}{path}: {err}".format(
+                url=self.connection._url, path=path, err=to_text(e)))
+        status_code, reason, response_headers, content = response
+        return status_code, reason, response_headers, to_text(content), reused
+
+    def _request(self, method, path, body, headers):
+        self._conn.request(method, path, body=body, headers=headers)
+        r = self._conn.getresponse()
+        content = r.read()
+        response_headers = dict((k.lower(), v) for k, v in r.getheaders())
+        if r.will_close:
+            self._close()
+        return r.status, to_text(r.reason), response_headers, content
+
+    def _connect(self):
+        """
+        Opens a new connection to the Caddy API, using the TLS options of the httpapi connection
+        """
+        host = self.connection.get_option("host")
+        port = self.connection.get_option("port")
+        timeout = self.connection.get_option("persistent_command_timeout")
+        if self.connection.get_option("use_ssl"):
+            context = ssl.create_default_context(cafile=self.connection.get_option("ca_path"))
+            if not self.connection.get_option("validate_certs"):
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            if self.connection.get_option("client_cert"):
+                context.load_cert_chain(self.connection.get_option("client_cert"),
+                                        self.connection.get_option("client_key"))
+            conn = HTTPSConnection(host, port, timeout=timeout, context=context)
+        else:
+            conn = HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        return conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
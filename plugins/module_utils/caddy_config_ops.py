@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import copy
+
+from .caddyserver import split_path, build_path_skeleton, ConfigFile, _ABSENT
+from .caddy_diff import apply_writes, diff_config, diff_output, plan_writes, _key
+
+
+def create_or_update_config(server, params, check_mode=False, diff=False):
+    """
+    Creates or updates the configuration at the given path.
+    Returns a result dictionary for server.exit_json(), including the list of changes.
+    If diff is set, the result also contains the diff to show to the user.
+
+    If append is set, the POST method will be used, else, PATCH will be used.
+    POST will append to an array at path, while PATCH wil overwrite it.
+    Existing configuration is only updated where it differs from content, see plan_writes().
+    If force is set, will always push the configuration, even if no change would be made.
+
+    server can be a CaddyServer or a ConfigSnapshot.
+    content can also be a ConfigFile when using a CaddyServer, see create_or_update_config_file().
+    """
+    path = params['path']
+    content = params["content"]
+    if isinstance(content, ConfigFile):
+        return create_or_update_config_file(server, params, check_mode)
+
+    normalizer = getattr(server, "normalizer", None)
+    # We first test for an existing config object and create it right away if none is found
+    unchanged, current_config = server.config_compare(path, content)
+
+    if not unchanged or params.get("force"):
+        if params["append"]:
+            before, after = None, content
+            changes = [dict(op="add", path=path, after=content)]
+        else:
+            before, after = current_config, content
+            changes = diff_config(current_config, content, path, normalizer)
+
+        if check_mode:
+            pass
+        elif params["append"] and path.split("/")[-1].isdigit():
+            # Insert at array index with PUT
+            server.config_put(path, content, create_path=params["create_path"])
+        elif params["append"]:
+            # Other appends, post
+            server.config_post(path, content, create_path=params["create_path"])
+        elif current_config is not None:
+            # Only push the parts that changed. Forced updates without changes push everything
+            writes = plan_writes(current_config, content, path, normalizer=normalizer) or [("PATCH", path, content)]
+            apply_writes(server, writes)
+        else:
+            # current config doesn't exist, create
+            server.config_put(path, content, create_path=params["create_path"])
+
+        result = {"changed": True, "changes": changes}
+        if diff:
+            result["diff"] = diff_output(before, after, path, changes)
+        return result
+    return {"changed": False, "changes": []}
+
+
+def content_from_params(module):
+    """
+    Returns the configuration to push for a module with the content and src options.
+    If src is set, a ConfigFile is returned so that the file can be streamed,
+    unless diff mode is enabled, which requires the parsed configuration.
+    """
+    src = module.params.get("src")
+    if not src:
+        return module.params["content"]
+    content = ConfigFile(src)
+    if not module._diff:
+        return content
+    try:
+        return content.load()
+    except (OSError, ValueError) as e:
+        module.fail_json(msg="Could not read configuration from {src}: {err}".format(src=src, err=str(e)))
+        return None
+
+
+def create_or_update_config_file(server, params, check_mode=False):
+    """
+    Creates or updates the configuration at the given path from a ConfigFile in params["content"].
+
+    The running configuration is only hashed while it is received and compared against the hash of the file,
+    so that neither of them is ever held in memory. Both hashes are canonical, see CanonicalDigest.
+    If they differ, the file is streamed to Caddy as-is, replacing the entire configuration at path.
+    The result does not contain the list of changes, as that requires parsing both configurations.
+    """
+    path = params["path"]
+    content = params["content"]
+
+    try:
+        digest = content.digest(server.normalizer, path)
+    except (OSError, ValueError) as e:
+        server.module.fail_json(msg="Could not read configuration from {src}: {err}".format(src=content.path, err=str(e)))
+        return None
+
+    current_digest = server.config_digest(path, canonical=True)
+    if current_digest == digest and not params.get("force"):
+        return {"changed": False}
+
+    if check_mode:
+        pass
+    elif params["append"] and path.split("/")[-1].isdigit():
+        server.config_put(path, content, create_path=params["create_path"])
+    elif params["append"]:
+        server.config_post(path, content, create_path=params["create_path"])
+    elif current_digest is not None:
+        server.config_patch(path, content, create_path=False)
+    else:
+        server.config_put(path, content, create_path=params["create_path"])
+    return {"changed": True}
+
+
+def upsert_config(server, params, check_mode=False, diff=False):
+    """
+    Creates, updates or deletes a single item of the array at path, identified by its value at params["key"]
+    instead of its index. The item is found by fetching the array once, so that the change only needs one write.
+    The value to look for is params["key_value"] if set, otherwise the value at key in the content.
+    Returns a result dictionary for server.exit_json(), including the index of the item that was touched.
+
+    server can be a CaddyServer or a ConfigSnapshot.
+    """
+    path = params["path"]
+    content = params["content"]
+    normalizer = getattr(server, "normalizer", None)
+    key = split_path(params["key"])
+    key_value = params.get("key_value")
+    if key_value is None and params["state"] == "present":
+        key_value = lookup_config(content, key)
+    if key_value is None or key_value is _ABSENT:
+        server.module.fail_json(msg="key_value is required unless the content contains the key {key}".format(
+            key=params["key"]))
+        return None
+
+    items = server.config_get(path)
+    if items is not None and not isinstance(items, list):
+        server.module.fail_json(msg="The configuration at {path} is not an array".format(path=path))
+        return None
+    before = items or []
+    index = find_item(before, key, key_value)
+
+    if params["state"] == "absent":
+        if index is None:
+            return {"changed": False, "changes": [], "index": None}
+        item_path = "{path}/{index}".format(path=path.rstrip("/"), index=index)
+        after = before[:index] + before[index + 1:]
+        changes = [dict(op="remove", path=item_path, before=before[index])]
+        if not check_mode:
+            server.config_delete(item_path)
+    elif index is None:
+        index = len(before)
+        item_path = "{path}/{index}".format(path=path.rstrip("/"), index=index)
+        after = before + [content]
+        changes = [dict(op="add", path=item_path, after=content)]
+        if check_mode:
+            pass
+        elif items is None:
+            server.config_put(path, [content], create_path=params["create_path"])
+        else:
+            server.config_post(path, content, create_path=False)
+    else:
+        item_path = "{path}/{index}".format(path=path.rstrip("/"), index=index)
+        unchanged = normalizer.equal(before[index], content, item_path) if normalizer else before[index] == content
+        if unchanged and not params.get("force"):
+            return {"changed": False, "changes": [], "index": index}
+        after = before[:index] + [content] + before[index + 1:]
+        changes = diff_config(before[index], content, item_path, normalizer)
+        if not check_mode:
+            writes = plan_writes(before[index], content, item_path, normalizer=normalizer)
+            apply_writes(server, writes or [("PATCH", item_path, content)])
+
+    result = {"changed": True, "changes": changes, "index": index}
+    if diff:
+        result["diff"] = diff_output(before, after, path, changes)
+    return result
+
+
+def append_config_items(server, params, check_mode=False, diff=False):
+    """
+    Appends all items in params["append_items"] to the array at path that are not part of it yet,
+    with a single request using Caddy's "..." expansion. Items are compared by content.
+    Returns a result dictionary for server.exit_json(), including the list of changes.
+
+    server can be a CaddyServer or a ConfigSnapshot.
+    """
+    path = params["path"]
+    if params["state"] != "present":
+        server.module.fail_json(msg="append_items can only be used with state=present")
+        return None
+
+    current = server.config_get(path)
+    if current is not None and not isinstance(current, list):
+        server.module.fail_json(msg="The configuration at {path} is not an array".format(path=path))
+        return None
+    before = current or []
+
+    normalizer = getattr(server, "normalizer", None)
+
+    def item_key(item, index):
+        if normalizer is not None:
+            item = normalizer.normalize(item, "{path}/{index}".format(path=path.rstrip("/"), index=index))
+        return _key(item)
+
+    present = set(item_key(item, i) for i, item in enumerate(before))
+    new_items = []
+    for item in params["append_items"]:
+        key = item_key(item, len(before) + len(new_items))
+        if key not in present:
+            present.add(key)
+            new_items.append(item)
+    if not new_items:
+        return {"changed": False, "changes": []}
+
+    changes = [dict(op="add", path="{path}/{index}".format(path=path.rstrip("/"), index=len(before) + i), after=item)
+               for i, item in enumerate(new_items)]
+    if check_mode:
+        pass
+    elif current is None:
+        server.config_put(path, new_items, create_path=params["create_path"])
+    else:
+        server.config_post("{path}/...".format(path=path.rstrip("/")), new_items, create_path=False)
+
+    result = {"changed": True, "changes": changes}
+    if diff:
+        result["diff"] = diff_output(before, before + new_items, path, changes)
+    return result
+
+
+def lookup_config(config, segments):
+    """
+    Returns the value at the given path segments inside config, or _ABSENT if it doesn't exist
+    """
+    for segment in segments:
+        if isinstance(config, dict) and segment in config:
+            config = config[segment]
+        elif isinstance(config, list) and segment.isdigit() and int(segment) < len(config):
+            config = config[int(segment)]
+        else:
+            return _ABSENT
+    return config
+
+
+def find_item(items, key, key_value):
+    """
+    Returns the index of the first item in items whose value at the path segments key equals key_value,
+    or None if there is no such item
+    """
+    for i, item in enumerate(items):
+        if lookup_config(item, key) == key_value:
+            return i
+    return None
+
+
+def delete_config(server, params, check_mode=False, diff=False):
+    """
+    Deletes the configuration at path if configuration is present.
+    Returns a result dictionary for server.exit_json(), including the list of changes.
+    If diff is set, the result also contains the diff to show to the user.
+
+    server can be a CaddyServer or a ConfigSnapshot.
+    """
+    path = params["path"]
+
+    current_config = server.config_get(path)
+    if current_config is None:
+        return {"changed": False, "changes": []}
+    elif not check_mode:
+        server.config_delete(path)
+
+    result = {"changed": True, "changes": [dict(op="remove", path=path, before=current_config)]}
+    if diff:
+        result["diff"] = diff_output(current_config, None, path)
+    return result
+
+
+def common_path(paths):
+    """
+    Returns the longest config path that all given paths start with
+    """
+    split = [split_path(path) for path in paths]
+    prefix = []
+    for segments in zip(*split):
+        if any(segment != segments[0] for segment in segments):
+            break
+        prefix.append(segments[0])
+    return "/".join(prefix)
+
+
+class IdConfig(object):
+    """
+    Provides the config_* methods of CaddyServer for the configuration below the object tagged with an @id,
+    so that it can be used with create_or_update_config() and delete_config().
+    Paths are relative to the object, the empty path refers to the object itself.
+    """
+
+    def __init__(self, server, obj_id):
+        self.server = server
+        self.module = server.module
+        self.normalizer = server.normalizer
+        self.obj_id = obj_id
+
+    def config_get(self, path):
+        return self.server.id_get(self.obj_id, path)
+
+    def config_digest(self, path, canonical=False):
+        return self.server.id_digest(self.obj_id, path, canonical=canonical)
+
+    def config_compare(self, path, config):
+        return self.server.id_compare(self.obj_id, path, config)
+
+    def config_load(self, config):
+        # Replacing the entire configuration below the object means replacing the object itself
+        return self.server.id_patch(self.obj_id, "", config, create_path=False)
+
+    def config_put(self, path, config, create_path=True):
+        return self.server.id_put(self.obj_id, path, config, create_path=create_path)
+
+    def config_post(self, path, config, create_path=True):
+        return self.server.id_post(self.obj_id, path, config, create_path=create_path)
+
+    def config_patch(self, path, config, create_path=True):
+        return self.server.id_patch(self.obj_id, path, config, create_path=create_path)
+
+    def config_delete(self, path):
+        return self.server.id_delete(self.obj_id, path)
+
+
+class ConfigSnapshotError(Exception):
+    pass
+
+
+class ConfigSnapshot(object):
+    """
+    Local copy of the Caddy configuration below a base path.
+
+    Provides the config_* methods of CaddyServer, but applies all changes to the local copy,
+    following the same rules as the Caddy API. Like for CaddyServer, paths are relative to the config root,
+    but they must be located below the base path.
+    The API requests that would have been needed for each change are recorded in requests.
+    If a ConfigNormalizer is given, it is used to compare configurations, like for CaddyServer.
+    """
+
+    _KEY = "config"
+
+    def __init__(self, base_path, config, normalizer=None):
+        self.base = split_path(base_path)
+        self.normalizer = normalizer
+        self._root = {} if config is None else {self._KEY: copy.deepcopy(config)}
+        self.base_exists = config is not None
+        self.original = copy.deepcopy(config)
+        self.requests = []
+
+    @property
+    def config(self):
+        """
+        The current content of the snapshot (None if the base path does not exist)
+        """
+        return self._root.get(self._KEY)
+
+    def config_get(self, path):
+        try:
+            return copy.deepcopy(self._access("GET", path))
+        except ConfigSnapshotError:
+            return None
+
+    def config_compare(self, path, config):
+        current = self.config_get(path)
+        if self.normalizer is not None:
+            return self.normalizer.equal(current, config, path), current
+        return current == config, current
+
+    def config_load(self, config):
+        if self.base:
+            raise ConfigSnapshotError("cannot load a new config into a snapshot of {path}".format(
+                path="/".join(self.base)))
+        self._root[self._KEY] = copy.deepcopy(config)
+        self.requests.append(("PATCH", "", copy.deepcopy(config)))
+
+    def config_put(self, path, config, create_path=True):
+        if create_path and self._create_path(path, config):
+            return
+        self._write("PUT", path, config)
+
+    def config_post(self, path, config, create_path=True):
+        if create_path and self._create_path(path, config):
+            return
+        self._write("POST", path, config)
+
+    def config_patch(self, path, config, create_path=True):
+        if create_path:
+            self._create_path(path)
+        self._write("PATCH", path, config)
+
+    def config_delete(self, path):
+        self._write("DELETE", path)
+
+    def _write(self, method, path, config=None):
+        self._access(method, path, copy.deepcopy(config))
+        self.requests.append((method, path, copy.deepcopy(config)))
+
+    def _parts(self, path):
+        """
+        Returns the segments of path below the base path, prefixed with the snapshot root key
+        """
+        segments = split_path(path)
+        if segments[:len(self.base)] != self.base:
+            raise ConfigSnapshotError("path {path} is not part of the snapshot".format(path=path))
+        return [self._KEY] + segments[len(self.base):]
+
+    def _create_path(self, path, config=_ABSENT):
+        """
+        Creates all missing objects along path, see CaddyServer._create_path().
+        Returns True if config was placed at the end of the path along with the missing objects.
+        """
+        parts = self._parts(path)
+        existing = 0
+        ptr = self._root
+        for part in parts[:-1]:
+            if isinstance(ptr, dict) and ptr.get(part) is not None:
+                ptr = ptr[part]
+            elif isinstance(ptr, list) and part.isdigit() and int(part) < len(ptr):
+                ptr = ptr[int(part)]
+            else:
+                break
+            existing += 1
+
+        missing = parts[existing:]
+        if len(missing) < 2:
+            return False
+        skeleton = build_path_skeleton(missing[1:], config)
+        self._write("PUT", "/".join(self.base + parts[1:existing + 1]), skeleton)
+        return config is not _ABSENT
+
+    # pylint: disable=too-many-branches
+    def _access(self, method, path, value=None):
+        """
+        Reads or modifies the value at path like the Caddy API would.
+        Returns the value at path for GET, None otherwise.
+        Raises ConfigSnapshotError if the API would reject the request.
+        """
+        parts = self._parts(path)
+        # A final "..." appends all items of the value to the array before it
+        ellipsis = parts[-1] == "..."
+        if ellipsis:
+            if method != "POST" or not isinstance(value, list):
+                raise ConfigSnapshotError("[{path}] final element is not an array".format(path=path))
+            parts = parts[:-1]
+        appended = value if ellipsis else [value]
+        ptr = self._root
+        for i, part in enumerate(parts):
+            if isinstance(ptr, dict):
+                # The final segment is an array index, handled separately
+                arr = ptr.get(part)
+                if isinstance(arr, list) and i == len(parts) - 2:
+                    idx = len(arr)
+                    if method != "POST":
+                        idx = self._index(parts, len(parts) - 1)
+                        if idx < 0 or (method != "PUT" and idx >= len(arr)) or idx > len(arr):
+                            raise ConfigSnapshotError("[{path}] array index out of bounds: {idx}".format(
+                                path=path, idx=idx))
+                    if method == "GET":
+                        return arr[idx]
+                    elif method == "POST":
+                        arr.extend(appended)
+                    elif method == "PUT":
+                        arr.insert(idx, value)
+                    elif method == "PATCH":
+                        arr[idx] = value
+                    elif method == "DELETE":
+                        del arr[idx]
+                    return None
+
+                if i == len(parts) - 1:
+                    if method == "GET":
+                        return ptr.get(part)
+                    elif method == "POST":
+                        if isinstance(ptr.get(part), list):
+                            ptr[part].extend(appended)
+                        else:
+                            ptr[part] = value
+                    elif method == "PUT":
+                        if part in ptr:
+                            raise ConfigSnapshotError("[{path}] key already exists: {part}".format(path=path, part=part))
+                        ptr[part] = value
+                    elif method in ("PATCH", "DELETE"):
+                        if part not in ptr:
+                            raise ConfigSnapshotError("[{path}] key does not exist: {part}".format(path=path, part=part))
+                        if method == "PATCH":
+                            ptr[part] = value
+                        else:
+                            del ptr[part]
+                    return None
+
+                # Like Caddy, create missing objects on the way when PUTting a new value
+                if ptr.get(part) is None and method == "PUT":
+                    ptr[part] = {}
+                ptr = ptr.get(part)
+            elif isinstance(ptr, list):
+                idx = self._index(parts, i)
+                if idx < 0 or idx >= len(ptr):
+                    raise ConfigSnapshotError("[{path}] array index out of bounds: {idx}".format(path=path, idx=idx))
+                ptr = ptr[idx]
+            else:
+                raise ConfigSnapshotError("invalid traversal path at: {path}".format(
+                    path="/".join(self.base + parts[1:i + 1])))
+        return None
+
+    @staticmethod
+    def _index(parts, i):
+        if not parts[i].lstrip("-").isdigit():
+            raise ConfigSnapshotError("invalid array index '{idx}'".format(idx=parts[i]))
+        return int(parts[i])
@@ -8,6 +8,8 @@ __metaclass__ = type
 
 
 caddyhost_argspec = dict(
+    api_trace=dict(type="bool", default=False),
     caddy_host=dict(type="str", default="http://localhost:2019"),
+    profile_file=dict(type="path"),
     timeout=dict(type="int", default=30)
 )
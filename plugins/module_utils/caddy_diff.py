@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import difflib
+import json
+
+from .caddyserver import split_path
+
+
+def _join(segments):
+    return "/".join(segments)
+
+
+def _key(value):
+    """
+    Hashable representation of a config value, used to match array items
+    """
+    return json.dumps(value, sort_keys=True)
+
+
+def _get(config, segments):
+    for segment in segments:
+        config = config[int(segment)] if isinstance(config, list) else config[segment]
+    return config
+
+
+def _common_segments(paths):
+    prefix = list(paths[0])
+    for segments in paths[1:]:
+        i = 0
+        while i < min(len(prefix), len(segments)) and prefix[i] == segments[i]:
+            i += 1
+        prefix = prefix[:i]
+    return prefix
+
+
+def _same(before, after, segments, normalizer):
+    if before == after:
+        return True
+    return normalizer is not None and normalizer.equal(before, after, _join(segments))
+
+
+def diff_config(before, after, path="", normalizer=None):
+    """
+    Computes the structural difference between two configurations located at path.
+
+    Returns a list of changes, each of which is a dict with the following keys:
+    - op: One of "add", "remove", "change" or "move"
+    - path: Config path of the changed value. For removed array items, this is their index in before,
+      for all others their index in after
+    - before: Previous value (not set for "add")
+    - after: New value (not set for "remove")
+    - from: Previous config path of a moved array item (only set for "move")
+
+    If a ConfigNormalizer is given, values that it considers equal are not reported as changes.
+    """
+    changes = []
+    _diff(before, after, split_path(path), changes, normalizer)
+    return changes
+
+
+def _diff(before, after, segments, changes, normalizer=None):
+    if _same(before, after, segments, normalizer):
+        return
+    if before is None:
+        changes.append(dict(op="add", path=_join(segments), after=after))
+    elif after is None:
+        changes.append(dict(op="remove", path=_join(segments), before=before))
+    elif isinstance(before, dict) and isinstance(after, dict):
+        for key in sorted(set(before) | set(after)):
+            child = segments + [key]
+            if normalizer is not None and normalizer.equal(before.get(key), after.get(key), _join(child)):
+                continue
+            if key not in after:
+                changes.append(dict(op="remove", path=_join(child), before=before[key]))
+            elif key not in before:
+                changes.append(dict(op="add", path=_join(child), after=after[key]))
+            else:
+                _diff(before[key], after[key], child, changes, normalizer)
+    elif isinstance(before, list) and isinstance(after, list):
+        _diff_list(before, after, segments, changes, normalizer)
+    else:
+        changes.append(dict(op="change", path=_join(segments), before=before, after=after))
+
+
+def _diff_list(before, after, segments, changes, normalizer=None):
+    before_keys = [_key(item) for item in before]
+    after_keys = [_key(item) for item in after]
+    removed = []
+    added = []
+    matcher = difflib.SequenceMatcher(None, before_keys, after_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        for offset in range(paired):
+            # Items replaced in place are compared recursively to find the actual change
+            _diff(before[i1 + offset], after[j1 + offset], segments + [str(j1 + offset)], changes, normalizer)
+        removed.extend(range(i1 + paired, i2))
+        added.extend(range(j1 + paired, j2))
+
+    # Items that were removed in one place and added in another have been moved
+    for i in list(removed):
+        for j in added:
+            if before_keys[i] == after_keys[j]:
+                changes.append(dict(op="move", path=_join(segments + [str(j)]), before=before[i], after=after[j],
+                                    **{"from": _join(segments + [str(i)])}))
+                removed.remove(i)
+                added.remove(j)
+                break
+    for i in removed:
+        changes.append(dict(op="remove", path=_join(segments + [str(i)]), before=before[i]))
+    for j in added:
+        changes.append(dict(op="add", path=_join(segments + [str(j)]), after=after[j]))
+
+
+def plan_writes(before, after, path="", max_writes=1, normalizer=None):
+    """
+    Computes the API writes needed to turn the configuration before into after, both located at path.
+    before must exist, i.e. not be None.
+
+    Each write is a tuple (method, path, value), ordered so that they can be applied one after another.
+    Changes are written as deep in the config as possible, so that only the changed parts are sent.
+    Caddy reloads its configuration after each write, so if more than max_writes writes would be needed,
+    a single write of the deepest object containing all changes is returned instead.
+    If a ConfigNormalizer is given, values that it considers equal are not written.
+    """
+    segments = split_path(path)
+    writes = []
+    _plan(before, after, segments, writes, normalizer)
+    if len(writes) <= max_writes:
+        return writes
+
+    common = _common_segments([[s for s in split_path(p) if s != "..."] for _, p, _ in writes])
+    return [("PATCH", _join(common), _get(after, common[len(segments):]))]
+
+
+def _plan(before, after, segments, writes, normalizer=None):
+    if _same(before, after, segments, normalizer):
+        return
+    if isinstance(before, dict) and isinstance(after, dict):
+        for key in sorted(set(before) | set(after)):
+            child = segments + [key]
+            if normalizer is not None and normalizer.equal(before.get(key), after.get(key), _join(child)):
+                continue
+            if key not in after:
+                writes.append(("DELETE", _join(child), None))
+            elif key not in before:
+                writes.append(("PUT", _join(child), after[key]))
+            else:
+                _plan(before[key], after[key], child, writes, normalizer)
+    # Caddy can only address items of arrays that are stored under an object key
+    elif isinstance(before, list) and isinstance(after, list) and segments and not segments[-1].isdigit():
+        if len(after) > len(before) and after[:len(before)] == before:
+            # Append all new items at once
+            writes.append(("POST", _join(segments + ["..."]), after[len(before):]))
+        elif len(after) == len(before):
+            for i in range(len(before)):
+                _plan(before[i], after[i], segments + [str(i)], writes, normalizer)
+        else:
+            writes.append(("PATCH", _join(segments), after))
+    else:
+        writes.append(("PATCH", _join(segments), after))
+
+
+def apply_writes(server, writes):
+    """
+    Sends writes created by plan_writes() to the server.
+    """
+    for method, path, value in writes:
+        if method == "DELETE":
+            server.config_delete(path)
+        else:
+            getattr(server, "config_{m}".format(m=method.lower()))(path, value, create_path=False)
+
+
+def diff_output(before, after, path="", changes=None):
+    """
+    Creates the value of the diff key of a module result.
+    Only the deepest object containing all changes is shown, so that the diff stays readable for large configs.
+    """
+    if changes is None:
+        changes = diff_config(before, after, path)
+    segments = split_path(path)
+    if changes:
+        paths = [split_path(c["path"]) for c in changes] + [split_path(c["from"]) for c in changes if "from" in c]
+        common = _common_segments(paths)
+        # Show the whole array if items were added, removed or moved, so that the indices make sense
+        if len(common) > len(segments) and common[-1].isdigit() and any(c["op"] != "change" for c in changes):
+            common = common[:-1]
+        before = _get_or_none(before, common[len(segments):])
+        after = _get_or_none(after, common[len(segments):])
+        segments = common
+    header = "config/" + _join(segments)
+    return dict(
+        before=json.dumps(before, indent=2, sort_keys=True) + "\n",
+        after=json.dumps(after, indent=2, sort_keys=True) + "\n",
+        before_header=header,
+        after_header=header,
+    )
+
+
+def _get_or_none(config, segments):
+    try:
+        return _get(config, segments)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
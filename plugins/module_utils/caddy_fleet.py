@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .caddyserver import CaddyServer
+
+DEFAULT_MAX_IN_FLIGHT = 10
+
+caddy_fleet_argspec = dict(
+    caddy_hosts=dict(type="list", elements="str"),
+    max_in_flight=dict(type="int", default=DEFAULT_MAX_IN_FLIGHT),
+    max_failures=dict(type="int"),
+    node_timeout=dict(type="int"),
+)
+
+
+class CaddyNodeError(Exception):
+    """
+    Raised instead of failing the module when an operation on a single node fails
+    """
+
+
+class NodeModule(object):
+    """
+    Stand-in for the AnsibleModule when working with one node out of many.
+    Everything is passed through to the real module, except that failing or exiting
+    raises CaddyNodeError so that the other nodes are not affected.
+    """
+
+    # Nodes are always contacted directly, never through a persistent connection
+    _socket_path = None
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def fail_json(self, msg, **kwargs):
+        raise CaddyNodeError(msg)
+
+    def exit_json(self, **kwargs):
+        raise CaddyNodeError(kwargs.get("msg", "Unexpected exit"))
+
+
+def run_on_node(module, host, func):
+    """
+    Calls func(node_module, server) for a single Caddy host and returns its result,
+    along with the host, whether the node failed and its API statistics.
+    Any error only fails this node. If node_timeout is set, the node fails once its requests take longer than that.
+    """
+    node = NodeModule(module)
+    deadline = None
+    if module.params.get("node_timeout"):
+        deadline = time.monotonic() + module.params["node_timeout"]
+    server = CaddyServer(node, host, timeout=module.params["timeout"], deadline=deadline)
+    try:
+        result = func(node, server)
+        result["failed"] = False
+    except CaddyNodeError as e:
+        result = {"changed": False, "failed": True, "msg": str(e)}
+    except Exception as e:  # pylint: disable=broad-except
+        # Such as an error response that isn't valid JSON. The other nodes must not be affected
+        result = {"changed": False, "failed": True, "msg": "Unexpected error: {err!r}".format(err=e)}
+    finally:
+        server.close()
+    result["caddy_host"] = host
+    result.update(server.api_result())
+    return result
+
+
+def run_on_fleet(module, hosts, func, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_failures=None):
+    """
+    Calls func(node_module, server) for each host in hosts, using a pool of max_in_flight threads.
+    Once max_failures nodes have failed, no further nodes are started. Nodes that are already running are completed.
+
+    Returns a list with the result of each host (see run_on_node()), in the same order as hosts.
+    Hosts that were not started are returned with skipped=True.
+    """
+    results = [None] * len(hosts)
+    pending = list(enumerate(hosts))
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        running = {}
+        while pending or running:
+            stopped = max_failures is not None and failures >= max_failures
+            while pending and not stopped and len(running) < max_in_flight:
+                i, host = pending.pop(0)
+                running[executor.submit(run_on_node, module, host, func)] = i
+            if not running:
+                break
+            done = wait(running, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                i = running.pop(future)
+                results[i] = future.result()
+                failures += results[i]["failed"]
+
+    for i, host in pending:
+        results[i] = {"caddy_host": host, "changed": False, "failed": False, "skipped": True,
+                      "msg": "Skipped after {n} failed nodes".format(n=failures)}
+    return results
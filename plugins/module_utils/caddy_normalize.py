@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import json
+import re
+
+# Duration strings as accepted by Caddy: Go durations, plus "d" for days
+DURATION_RE = re.compile(r"^-?(?:(?:\d+(?:\.\d*)?|\.\d+)(?:ns|us|\u00b5s|\u03bcs|ms|s|m|h|d))+$")
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d*)?|\.\d+)(ns|us|\u00b5s|\u03bcs|ms|s|m|h|d)")
+_DURATION_UNITS = {
+    "ns": 1,
+    "us": 10 ** 3,
+    u"\u00b5s": 10 ** 3,
+    u"\u03bcs": 10 ** 3,
+    "ms": 10 ** 6,
+    "s": 10 ** 9,
+    "m": 60 * 10 ** 9,
+    "h": 3600 * 10 ** 9,
+    "d": 86400 * 10 ** 9,
+}
+
+# Config fields of the standard Caddy modules that hold a duration.
+# Caddy accepts these as duration strings or integer nanoseconds, other strings are compared as they are.
+DURATION_FIELDS = frozenset([
+    # HTTP app and servers
+    "grace_period", "shutdown_delay", "read_timeout", "read_header_timeout", "write_timeout", "idle_timeout",
+    "keepalive_interval",
+    # Reverse proxy, its transports, load balancing and health checks
+    "flush_interval", "stream_timeout", "stream_close_delay", "dial_timeout", "dial_fallback_delay",
+    "response_header_timeout", "expect_continue_timeout", "probe_interval", "try_duration", "try_interval",
+    "fail_duration", "unhealthy_latency", "refresh",
+    # TLS app and PKI
+    "renew_interval", "ocsp_interval", "storage_clean_interval", "rotation_interval", "propagation_delay",
+    "propagation_timeout", "lifetime", "intermediate_lifetime",
+])
+
+# Path segment that matches any object key or array index in ignore_paths and unordered_paths
+WILDCARD = "*"
+
+caddy_compare_argspec = dict(
+    ignore_paths=dict(type="list", elements="str", default=[]),
+    unordered_paths=dict(type="list", elements="str", default=[]),
+    normalize=dict(type="bool", default=False),
+)
+
+
+def parse_duration(value):
+    """
+    Returns the number of nanoseconds in a Caddy duration string such as "1m30s", or None if value is not one
+    """
+    if not DURATION_RE.match(value):
+        return None
+    total = 0
+    for number, unit in _DURATION_PART_RE.findall(value):
+        total += float(number) * _DURATION_UNITS[unit]
+    return int(-total if value.startswith("-") else total)
+
+
+def _split(path):
+    path = path.strip("/")
+    return path.split("/") if path else []
+
+
+def _sort_key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+class ConfigNormalizer(object):
+    """
+    Brings configurations into a canonical form before they are compared,
+    so that values that mean the same to Caddy compare as equal.
+
+    With normalize set, values are normalized the way Caddy treats them when it provisions the config:
+    - Object members whose value is false, 0, "" or an empty array are dropped,
+      as Caddy's config structs omit empty values and treat them like missing ones.
+      Empty objects are kept, as their key may carry the meaning on its own (such as {"encodings": {"gzip": {}}}).
+    - Duration strings such as "1m" in DURATION_FIELDS are converted to integer nanoseconds,
+      which Caddy accepts interchangeably.
+    Members whose value is null are always dropped.
+
+    Independently of that, config paths in ignore_paths are left out, and arrays at unordered_paths are sorted.
+    Both are absolute config paths in which a "*" segment matches any key or index.
+    """
+
+    def __init__(self, ignore_paths=None, unordered_paths=None, normalize=False):
+        self.ignore_paths = [_split(path) for path in ignore_paths or []]
+        self.unordered_paths = [_split(path) for path in unordered_paths or []]
+        self.normalize_values = normalize
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Creates a normalizer from module parameters following caddy_compare_argspec.
+        Modules without these parameters get the default, exact comparison.
+        """
+        return cls(params.get("ignore_paths"), params.get("unordered_paths"), params.get("normalize", False))
+
+    def normalize(self, config, path=""):
+        """
+        Returns the canonical form of config, located at path. Values that are equivalent to no config are None.
+        """
+        segments = _split(path)
+        if self.ignored(segments):
+            return None
+        config = self._normalize(config, segments)
+        return None if self.is_empty(config) else config
+
+    def equal(self, first, second, path=""):
+        """
+        Returns whether two configurations located at path are equivalent.
+        Same as comparing their normalized forms, but only the parts that differ are normalized.
+        """
+        if first == second:
+            return True
+        segments = _split(path)
+        if self.ignored(segments):
+            return True
+        return self._equal(first, second, segments) or (self._empty(first, segments) and self._empty(second, segments))
+
+    def ignored(self, segments):
+        """
+        Returns whether the value at the given config path segments is left out of comparisons
+        """
+        return self._matches(self.ignore_paths, segments)
+
+    def unordered(self, segments):
+        """
+        Returns whether the order of the array at the given config path segments does not matter
+        """
+        return self._matches(self.unordered_paths, segments)
+
+    def normalize_scalar(self, value, key=None):
+        """
+        Returns the canonical form of a value that is not an array or object, stored under key
+        """
+        if self.normalize_values and key in DURATION_FIELDS and isinstance(value, str):
+            duration = parse_duration(value)
+            return value if duration is None else duration
+        return value
+
+    def is_empty(self, value):
+        """
+        Returns whether a normalized value is equivalent to no value at all.
+        Objects never are, even if they are empty.
+        """
+        # Booleans are numbers too, so "not value" covers false and 0 alongside empty strings and arrays
+        return value is None or (self.normalize_values and not isinstance(value, dict) and not value)
+
+    def _equal(self, first, second, segments):
+        """
+        Returns whether the normalized forms of two values are equal, descending only into members that differ
+        """
+        if first == second:
+            return True
+        if isinstance(first, dict) and isinstance(second, dict):
+            for key in set(first) | set(second):
+                child = segments + [key]
+                if key in first and key in second and first[key] == second[key] or self.ignored(child):
+                    continue
+                if key not in first or key not in second:
+                    if not self._empty(first.get(key, second.get(key)), child):
+                        return False
+                elif not (self._equal(first[key], second[key], child)
+                          or (self._empty(first[key], child) and self._empty(second[key], child))):
+                    return False
+            return True
+        if isinstance(first, list) and isinstance(second, list) and not self.unordered(segments):
+            first_items = [(str(i), item) for i, item in enumerate(first) if not self.ignored(segments + [str(i)])]
+            second_items = [(str(i), item) for i, item in enumerate(second) if not self.ignored(segments + [str(i)])]
+            if len(first_items) != len(second_items):
+                return False
+            for (first_index, first_item), (second_index, second_item) in zip(first_items, second_items):
+                if first_index != second_index:
+                    # Ignored items shifted the positions, which may change how the remaining items are normalized
+                    return self._normalize(first, segments) == self._normalize(second, segments)
+                if not self._equal(first_item, second_item, segments + [first_index]):
+                    return False
+            return True
+        return self._normalize(first, segments) == self._normalize(second, segments)
+
+    def _empty(self, config, segments):
+        """
+        Returns whether the normalized form of a value is equivalent to no value, stopping at the first non-empty member
+        """
+        if isinstance(config, dict):
+            return False
+        if isinstance(config, list):
+            return self.normalize_values and all(self.ignored(segments + [str(i)]) for i in range(len(config)))
+        return self.is_empty(self.normalize_scalar(config, segments[-1] if segments else None))
+
+    def _normalize(self, config, segments):
+        if isinstance(config, dict):
+            result = {}
+            for key, value in config.items():
+                child = segments + [key]
+                if self.ignored(child):
+                    continue
+                value = self._normalize(value, child)
+                if not self.is_empty(value):
+                    result[key] = value
+            return result
+        if isinstance(config, list):
+            items = [self._normalize(item, segments + [str(i)]) for i, item in enumerate(config)
+                     if not self.ignored(segments + [str(i)])]
+            if self.unordered(segments):
+                items.sort(key=_sort_key)
+            return items
+        return self.normalize_scalar(config, segments[-1] if segments else None)
+
+    @staticmethod
+    def _matches(patterns, segments):
+        for pattern in patterns:
+            if len(pattern) == len(segments) and all(p in (WILDCARD, s) for p, s in zip(pattern, segments)):
+                return True
+        return False
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import json
+import os
+import time
+
+# Fallback start of the "startup" phase on systems where the start time of the process is not known
+_LOADED = time.monotonic()
+
+
+def _process_start():
+    """
+    Returns the time.monotonic() at which this process was started, or None if it cannot be determined
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        # The start time is the 22nd field, in clock ticks since boot.
+        # The command name in the second field may contain spaces, so fields are counted from its closing parenthesis.
+        started = int(stat.rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        running = time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (AttributeError, IndexError, OSError, ValueError):
+        return None
+    return time.monotonic() - running if running >= 0 else None
+
+
+class PhaseTimer(object):
+    """
+    Measures how long each phase of a module run takes, for writing it to the profile_file.
+    A phase lasts from the end of the previous one until mark() is called with its name.
+    The first phase, "startup", lasts from the start of the module process until the timer is created.
+    It covers starting the interpreter, unpacking the module and all imports,
+    or only the time since this file was imported where the process start time is not available.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = []
+        start = _process_start()
+        self._last = _LOADED if start is None else min(start, _LOADED)
+        self.mark("startup")
+
+    def mark(self, name):
+        now = time.monotonic()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def finish(self, calls):
+        """
+        Ends the run and returns the duration of each phase in seconds.
+        The time since the last mark is split into API reads ("fetch"), API writes ("write")
+        and everything in between ("compare"), based on the recorded API calls.
+        """
+        run = time.monotonic() - self._last
+        fetch = sum(call["duration_ms"] for call in calls if call["method"] == "GET") / 1000
+        write = sum(call["duration_ms"] for call in calls if call["method"] != "GET") / 1000
+        phases = dict(self.phases)
+        phases.update(fetch=fetch, compare=max(run - fetch - write, 0), write=write)
+        return dict((name, round(duration, 6)) for name, duration in phases.items())
+
+
+def write_profile(module, path, timer, server):
+    """
+    Appends the phase timings and API statistics of this module run to path, as a single line of JSON.
+    Failing to write the profile only results in a warning.
+    """
+    phases = timer.finish(server.calls)
+    record = {
+        "module": getattr(module, "_name", None),
+        "caddy_host": server.addr,
+        "started": timer.started,
+        "total": round(sum(phases.values()), 6),
+        "phases": phases,
+        "caddy_api_stats": server.api_stats(),
+    }
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    except (IOError, OSError) as e:
+        module.warn("Could not write profile to {path}: {err}".format(path=path, err=str(e)))
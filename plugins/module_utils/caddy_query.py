@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+from .caddyserver import split_path, _ABSENT
+
+# Path segment that selects all items of an object or array in a projection
+WILDCARD = "*"
+
+
+def summarize_config(config):
+    """
+    Returns a summary of a configuration value instead of its content:
+    its type, the number of items for arrays and objects, and the keys for objects.
+    Returns None for a missing value.
+    """
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return {"type": "object", "length": len(config), "keys": sorted(config)}
+    if isinstance(config, list):
+        return {"type": "array", "length": len(config)}
+    if isinstance(config, bool):
+        return {"type": "boolean"}
+    if isinstance(config, (int, float)):
+        return {"type": "number"}
+    return {"type": "string"}
+
+
+def truncate_config(config, depth):
+    """
+    Returns config with all objects and arrays nested more than depth levels deep replaced by their summary,
+    see summarize_config(). With a depth of 0, a summary of config itself is returned.
+    """
+    if not isinstance(config, (dict, list)):
+        return config
+    if depth <= 0:
+        return summarize_config(config)
+    if isinstance(config, dict):
+        return dict((key, truncate_config(value, depth - 1)) for key, value in config.items())
+    return [truncate_config(item, depth - 1) for item in config]
+
+
+def project_config(config, fields):
+    """
+    Returns only the parts of config selected by fields, keeping their position in the config.
+
+    Each field is a path relative to config, such as "routes/0/handle".
+    A segment of "*" selects all items of an object or array, for example "*/listen" returns
+    the listen addresses of every server when applied to apps/http/servers.
+    Array items keep their index, items before a selected one that are not selected themselves are None.
+    Fields that don't exist are left out. Returns None if no field exists.
+    """
+    result = _ABSENT
+    for field in fields:
+        result = _merge(result, _project(config, split_path(field)))
+    return None if result is _ABSENT else result
+
+
+def _project(config, segments):
+    if not segments:
+        return config
+    segment, rest = segments[0], segments[1:]
+    if isinstance(config, dict):
+        keys = config.keys() if segment == WILDCARD else [segment] if segment in config else []
+        projected = dict((key, _project(config[key], rest)) for key in keys)
+        projected = dict((key, value) for key, value in projected.items() if value is not _ABSENT)
+        return projected if projected or segment == WILDCARD else _ABSENT
+    if isinstance(config, list):
+        if segment == WILDCARD:
+            return [None if value is _ABSENT else value for value in (_project(item, rest) for item in config)]
+        if segment.isdigit() and int(segment) < len(config):
+            value = _project(config[int(segment)], rest)
+            return _ABSENT if value is _ABSENT else [None] * int(segment) + [value]
+    return _ABSENT
+
+
+def _merge(first, second):
+    # Missing array items are None in wildcard projections, Caddy configs don't contain null values otherwise
+    if first is _ABSENT or first is None:
+        return second
+    if second is _ABSENT or second is None:
+        return first
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged = dict(first)
+        for key, value in second.items():
+            merged[key] = _merge(merged.get(key, _ABSENT), value)
+        return merged
+    if isinstance(first, list) and isinstance(second, list):
+        # Items at the same index come from the same item of the config
+        merged = list(first) + [None] * (len(second) - len(first))
+        for index, value in enumerate(second):
+            merged[index] = _merge(merged[index], value)
+        return merged
+    return second
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import codecs
+import hashlib
+import json
+import re
+
+from .caddy_normalize import ConfigNormalizer, _split
+
+# Object members and unordered array items are combined by adding up their hashes,
+# so that the result does not depend on their order and only a single number needs to be kept per container.
+_MODULUS = 2 ** 256
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+# Characters that may follow a complete value
+_DELIMITERS = " \t\n\r,]}"
+
+# Parses complete JSON values from a position in a string, using the C implementation where available
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _scalar_hash(value):
+    if value is None:
+        data = b"z"
+    elif value is True:
+        data = b"t"
+    elif value is False:
+        data = b"f"
+    elif isinstance(value, (int, float)):
+        # Caddy stores all numbers as floats and writes integral ones without a fraction
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        data = b"n" + repr(value).encode("ascii")
+    else:
+        data = b"s" + value.encode("utf-8")
+    return hashlib.sha256(data).digest()
+
+
+NULL_HASH = _scalar_hash(None)
+
+
+def _member_value(key, value_hash):
+    return int.from_bytes(hashlib.sha256(b"k" + key.encode("utf-8") + b"\0" + value_hash).digest(), "big")
+
+
+def _combined_hash(kind, acc, count):
+    return hashlib.sha256(kind + acc.to_bytes(32, "big") + str(count).encode("ascii")).digest()
+
+
+class _Container(object):
+    """
+    Hash of an object or array that is built up one member at a time
+    """
+
+    __slots__ = ("kind", "segments", "key", "index", "ignored", "drop_empty", "_acc", "_count")
+
+    def __init__(self, kind, segments, ignored=False, drop_empty=False):
+        # "o" for objects, "a" for arrays and "u" for arrays whose order does not matter
+        self.kind = kind
+        self.segments = segments
+        self.key = None
+        self.index = 0
+        self.ignored = ignored
+        self.drop_empty = drop_empty
+        self._acc = hashlib.sha256(b"a") if kind == "a" else 0
+        self._count = 0
+
+    def child_segments(self):
+        if self.segments is None:
+            return None
+        return self.segments + [self.key if self.kind == "o" else str(self.index)]
+
+    def add(self, value_hash, empty):
+        if self.kind == "o":
+            if empty:
+                return
+            self._acc += _member_value(self.key, value_hash)
+        elif self.kind == "u":
+            self._acc += int.from_bytes(value_hash, "big")
+        else:
+            self._acc.update(value_hash)
+        self._count += 1
+
+    def finish(self):
+        """
+        Returns the hash of the container and whether it is empty
+        """
+        if self.kind == "a":
+            value_hash = self._acc.digest()
+        else:
+            value_hash = _combined_hash(self.kind.encode("ascii"), self._acc % _MODULUS, self._count)
+        # Empty objects are kept, see ConfigNormalizer
+        return value_hash, self.drop_empty and self.kind != "o" and self._count == 0
+
+
+class CanonicalDigest(object):
+    """
+    Hash of the canonical form of a configuration (see ConfigNormalizer), computed from its JSON serialization chunk by chunk.
+
+    The serialized configuration is parsed incrementally: complete values within the current chunk are parsed at once,
+    while objects and arrays spanning multiple chunks are hashed member by member.
+    Each object or array is reduced to a single hash as soon as it is complete, so memory use only depends
+    on the nesting depth and the chunk size, not on the size of the configuration.
+    Two configurations have the same digest if they are equivalent, regardless of key order or formatting.
+
+    Provides the same interface as ConfigDigest, so that it can be used with CaddyServer._resolve().
+    """
+
+    def __init__(self, normalizer=None, path=""):
+        self._normalizer = normalizer or ConfigNormalizer(normalize=False)
+        self._drop_empty = self._normalizer.normalize_values
+        # Config paths only need to be tracked if there are rules that depend on them
+        self._base = _split(path) if self._normalizer.ignore_paths or self._normalizer.unordered_paths else None
+        # Key of the configuration itself, which decides whether a scalar at the top level is a duration
+        self._key = (_split(path) or [None])[-1]
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = u""
+        self._stack = []
+        self._state = "value"
+        self._result = None
+        self._raw_null = False
+        self._hexdigest = None
+        # Number of serialized bytes processed
+        self.size = 0
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        self._buf += self._decoder.decode(chunk)
+        self._parse(final=False)
+
+    def hexdigest(self):
+        """
+        Returns the digest as a hex string.
+        Raises ValueError if the data passed to update() was not a complete JSON document.
+        """
+        if self._hexdigest is None:
+            if self._state != "done":
+                self._buf += self._decoder.decode(b"", final=True)
+                self._parse(final=True)
+            if self._state != "done" or self._buf.strip():
+                raise ValueError("Invalid or incomplete JSON configuration")
+            value_hash, empty = self._result
+            self._hexdigest = (NULL_HASH if empty else value_hash).hex()
+        return self._hexdigest
+
+    def is_null(self):
+        """
+        Returns whether the configuration was null, i.e. not present
+        """
+        self.hexdigest()
+        return self._raw_null
+
+    def __eq__(self, other):
+        return isinstance(other, CanonicalDigest) and self.hexdigest() == other.hexdigest()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _hash_value(self, value, segments, key=None):
+        """
+        Returns the hash of a parsed value stored under key and whether it is equivalent to no value.
+        This is the same as feeding its serialization through the parser, just faster.
+        """
+        normalizer = self._normalizer
+        if isinstance(value, dict):
+            acc = count = 0
+            for key, item in value.items():
+                child = None
+                if segments is not None:
+                    child = segments + [key]
+                    if normalizer.ignored(child):
+                        continue
+                item_hash, empty = self._hash_value(item, child, key)
+                if not empty:
+                    acc += _member_value(key, item_hash)
+                    count += 1
+            return _combined_hash(b"o", acc % _MODULUS, count), False
+        if isinstance(value, list):
+            unordered = segments is not None and normalizer.unordered(segments)
+            acc = 0 if unordered else hashlib.sha256(b"a")
+            count = 0
+            for index, item in enumerate(value):
+                child = None
+                if segments is not None:
+                    child = segments + [str(index)]
+                    if normalizer.ignored(child):
+                        continue
+                item_hash = self._hash_value(item, child)[0]
+                if unordered:
+                    acc += int.from_bytes(item_hash, "big")
+                else:
+                    acc.update(item_hash)
+                count += 1
+            if unordered:
+                return _combined_hash(b"u", acc % _MODULUS, count), self._drop_empty and count == 0
+            return acc.digest(), self._drop_empty and count == 0
+        if self._drop_empty and isinstance(value, str):
+            value = normalizer.normalize_scalar(value, key)
+        return _scalar_hash(value), value is None or (self._drop_empty and not value)
+
+    def _child_segments(self):
+        return self._stack[-1].child_segments() if self._stack else self._base
+
+    def _ignored(self, segments):
+        if self._stack and self._stack[-1].ignored:
+            return True
+        return segments is not None and self._normalizer.ignored(segments)
+
+    def _add(self, value_hash, empty, ignored=False):
+        """
+        Adds a complete value to the innermost container, or stores it as the result at the top level
+        """
+        if not self._stack:
+            self._result = (NULL_HASH, True) if ignored else (value_hash, empty)
+            self._state = "done"
+            return
+        container = self._stack[-1]
+        if not ignored:
+            container.add(value_hash, empty)
+        container.index += 1
+        self._state = "comma"
+
+    def _add_value(self, value):
+        segments = self._child_segments()
+        if not self._stack:
+            self._raw_null = value is None
+            key = self._key
+        else:
+            key = self._stack[-1].key if self._stack[-1].kind == "o" else None
+        if self._ignored(segments):
+            self._add(None, True, ignored=True)
+        else:
+            self._add(*self._hash_value(value, segments, key))
+
+    def _open(self, char):
+        segments = self._child_segments()
+        ignored = self._ignored(segments)
+        unordered = segments is not None and self._normalizer.unordered(segments)
+        kind = "o" if char == "{" else "u" if unordered else "a"
+        self._stack.append(_Container(kind, segments, ignored=ignored, drop_empty=self._drop_empty))
+        self._state = "first_key" if kind == "o" else "first_value"
+
+    def _close(self):
+        container = self._stack.pop()
+        value_hash, empty = container.finish()
+        self._add(value_hash, empty, ignored=container.ignored)
+
+    # pylint: disable=too-many-branches,too-many-statements
+    def _parse(self, final):
+        buf = self._buf
+        end = len(buf)
+        pos = 0
+        while True:
+            pos = _WHITESPACE_RE.match(buf, pos).end()
+            if pos >= end:
+                break
+            char = buf[pos]
+            state = self._state
+
+            if state == "done":
+                raise ValueError("Extra data after the JSON configuration at position {pos}".format(pos=self.size))
+            if state in ("first_key", "first_value") and char in "}]":
+                if (char == "}") != (state == "first_key"):
+                    raise ValueError("Unexpected '{char}' in JSON configuration".format(char=char))
+                self._close()
+                pos += 1
+            elif state == "comma":
+                if char == ",":
+                    self._state = "key" if self._stack[-1].kind == "o" else "value"
+                elif char in "}]" and (char == "}") == (self._stack[-1].kind == "o"):
+                    self._close()
+                else:
+                    raise ValueError("Unexpected '{char}' in JSON configuration".format(char=char))
+                pos += 1
+            elif state == "colon":
+                if char != ":":
+                    raise ValueError("Unexpected '{char}' in JSON configuration".format(char=char))
+                self._state = "value"
+                pos += 1
+            elif state in ("key", "first_key"):
+                if char != '"':
+                    raise ValueError("Unexpected '{char}' in JSON configuration".format(char=char))
+                try:
+                    key, pos = _scan_once(buf, pos)
+                except (StopIteration, ValueError):
+                    # The key continues in the next chunk
+                    if final:
+                        raise ValueError("Invalid or incomplete JSON configuration")
+                    break
+                self._stack[-1].key = key
+                self._state = "colon"
+            elif char in "{[":
+                try:
+                    value, pos = _scan_once(buf, pos)
+                except (StopIteration, ValueError):
+                    # Too large to be parsed at once, hash it member by member
+                    self._open(char)
+                    pos += 1
+                    continue
+                self._add_value(value)
+            else:
+                try:
+                    value, new_pos = _scan_once(buf, pos)
+                except (StopIteration, ValueError):
+                    if final:
+                        raise ValueError("Invalid or incomplete JSON configuration")
+                    break
+                if not final and not isinstance(value, str) and (new_pos == end or buf[new_pos] not in _DELIMITERS):
+                    # Numbers and literals may continue in the next chunk
+                    break
+                self._add_value(value)
+                pos = new_pos
+        self._buf = buf[pos:]
+
+
+def canonical_digest(config, normalizer=None, path=""):
+    """
+    Returns the CanonicalDigest of a parsed configuration located at path
+    """
+    digest = CanonicalDigest(normalizer, path)
+    digest._add_value(config)
+    return digest
@@ -7,59 +7,481 @@ from __future__ import (absolute_import, division, print_function)
 
 __metaclass__ = type
 
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+from ansible.module_utils.connection import Connection, ConnectionError as AnsibleConnectionError
+
+from .caddy_normalize import ConfigNormalizer
+from .caddy_profile import write_profile
+from .caddy_stream import CanonicalDigest
+
+# Caddy reports where a config path could not be followed in its error messages.
+# We use these to find the deepest existing part of a path without walking it segment by segment.
+TRAVERSAL_ERROR_RE = re.compile(r"invalid traversal path at: (\S+)")
+OUT_OF_BOUNDS_ERROR_RE = re.compile(r"\[(\S+)\] array index out of bounds")
+UNKNOWN_ID_ERROR_RE = re.compile(r"unknown object ID")
+# Only returned for a PATCH of the whole config after it was deleted, as Caddy then removes the config key
+MISSING_ROOT_ERROR_RE = re.compile(r"key does not exist: config$")
+
+# Marker for "no value given", as None is a valid config value
+_ABSENT = object()
+
+# How often a read-compare-write cycle is attempted if the config keeps changing underneath us
+CONFLICT_RETRIES = 3
+
+# Size of the chunks in which responses are read when they are not kept in memory
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Characters that Go's JSON encoder escapes inside strings
+_CADDY_JSON_ESCAPES = (
+    (u"<", u"\\u003c"),
+    (u">", u"\\u003e"),
+    (u"&", u"\\u0026"),
+    (u"\u2028", u"\\u2028"),
+    (u"\u2029", u"\\u2029"),
+)
+
+
+class CaddyResponse(object):
+    """
+    A fully read response of the Caddy API.
+    headers is either a case-insensitive message object or a dict with lowercase header names.
+    """
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    HTTP connection to a server listening on a unix domain socket
+    """
+
+    def __init__(self, socket_path, timeout):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class CaddyConflictError(Exception):
+    """
+    Raised when a write is rejected because the config changed since it was read (HTTP 412)
+    """
+
+
+def _escape_json(data):
+    for char, escaped in _CADDY_JSON_ESCAPES:
+        data = data.replace(char, escaped)
+    return data
+
+
+def encode_config(config):
+    """
+    Serializes config the same way the Caddy API does when returning it:
+    compact, with sorted keys, HTML characters escaped and a trailing newline.
+    """
+    data = json.dumps(config, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return (_escape_json(data) + u"\n").encode("utf-8")
+
+
+class ConfigDigest(object):
+    """
+    SHA-256 hash of a configuration serialized like the Caddy API does (see encode_config()),
+    computed chunk by chunk so that the serialized form never has to be held in memory.
+    """
+
+    def __init__(self):
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk):
+        self._sha.update(chunk)
+        self.size += len(chunk)
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+    def is_null(self):
+        return self.hexdigest() == NULL_DIGEST
+
+    def __eq__(self, other):
+        return isinstance(other, ConfigDigest) and self.hexdigest() == other.hexdigest()
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def digest_config(config):
+    """
+    Returns the ConfigDigest of config
+    """
+    digest = ConfigDigest()
+    encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    for chunk in encoder.iterencode(config):
+        digest.update(_escape_json(chunk).encode("utf-8"))
+    digest.update(b"\n")
+    return digest
+
+
+NULL_DIGEST = hashlib.sha256(encode_config(None)).hexdigest()
+
+
+class ConfigFile(object):
+    """
+    Configuration stored in a JSON file.
+    Can be passed to CaddyServer instead of a config object, in which case the file is streamed to Caddy as-is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._digest = None
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+
+    def digest(self, normalizer=None, path=""):
+        """
+        Returns the CanonicalDigest of the configuration in the file, located at path.
+        The file is read in chunks, so that it never has to be held in memory. The digest is only computed once.
+        Raises ValueError if the file does not contain valid JSON, or OSError if it cannot be read.
+        """
+        if self._digest is None:
+            digest = CanonicalDigest(normalizer, path)
+            with open(self.path, "rb") as f:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                while chunk:
+                    digest.update(chunk)
+                    chunk = f.read(STREAM_CHUNK_SIZE)
+            digest.hexdigest()
+            self._digest = digest
+        return self._digest
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+
+def split_path(path):
+    """
+    Splits a caddy config path into its segments. The root path ("" or "/") has no segments.
+    """
+    path = path.strip("/")
+    return path.split("/") if path else []
+
+
+def build_path_skeleton(segments, config=_ABSENT):
+    """
+    Builds the nested objects needed to hold the given path segments.
+    Each object is a list if the segment it holds is an integer, and a dict otherwise.
+    If config is given, it is placed at the end of the path.
+
+    For example, ["http", "servers"] results in {"http": {}},
+    while ["routes", "0"] with config C results in {"routes": [C]}.
+    """
+    node = [] if segments[0].isdigit() else {}
+    if len(segments) > 1:
+        child = build_path_skeleton(segments[1:], config)
+    elif config is not _ABSENT:
+        child = config
+    else:
+        return node
+    if isinstance(node, list):
+        node.append(child)
+    else:
+        node[segments[0]] = child
+    return node
 
 
 class CaddyServer(object):
 
-    def __init__(self, module, addr, timeout):
-        if not HAS_REQUESTS:
-            module.fail_json(msg="The 'requests' python package is required to run this module")
+    def __init__(self, module, addr, timeout, timer=None, deadline=None, normalizer=None):
         self.module = module
         self.timeout = timeout
+        # time.monotonic() by which all requests must be completed, see _request_timeout()
+        self.deadline = deadline
         # If the user does not specify a protocol we assume Caddys default: HTTP
-        if not addr.startswith("http"):
+        if not addr.startswith(("http", "unix://")):
             self.addr = "http://{addr}".format(addr=addr)
         else:
             self.addr = addr
+        if self.addr.startswith("unix://"):
+            # unix:///run/caddy/admin.sock, the path is everything after the scheme
+            self._scheme = "unix"
+            self._netloc = self.addr[len("unix://"):]
+            self._base_path = ""
+        else:
+            url = urlsplit(self.addr)
+            self._scheme = url.scheme
+            self._netloc = url.netloc
+            self._base_path = url.path.rstrip("/")
+
+        # All API calls of a module run go through one keep-alive connection so that
+        # subsequent requests reuse it instead of opening a new one each time.
+        self._conn = None
+        # When running through the httpapi connection plugin, requests are sent through its persistent connection process
+        self._httpapi = None
+        if getattr(module, "_socket_path", None):
+            self._httpapi = Connection(module._socket_path)
+            self._scheme = "httpapi"
+            self._base_path = ""
+        params = getattr(module, "params", None) or {}
+        # Used for all comparisons between the running and the desired config, see caddy_compare_argspec
+        self.normalizer = normalizer or ConfigNormalizer.from_params(params)
+        self.api_trace = params.get("api_trace", False)
+        self.profile_file = params.get("profile_file")
+        # PhaseTimer of the module run. Everything until now was spent parsing the module arguments
+        self.timer = timer
+        if timer is not None:
+            timer.mark("arguments")
+        # One entry per API call, see _make_request()
+        self.calls = []
+        self.request_count = 0
+        self.connections_opened = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Number of existing leading segments for each path read since the last write
+        self._existing_segments = {}
+        # ETag of the most recent read. The next write is made conditional on it
+        self._etag = None
+
+    def api_stats(self):
+        """
+        Returns a summary of the API calls made by this server instance,
+        including how many connections were opened and how many requests reused an existing one,
+        the number of body bytes sent and received, and the total time spent on API calls.
+        """
+        return {
+            "requests": self.request_count,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.request_count - self.connections_opened, 0),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "duration_ms": round(sum(call["duration_ms"] for call in self.calls), 3),
+        }
+
+    def api_result(self):
+        """
+        Returns the API statistics to add to a module result, along with the trace of all API calls if api_trace is set
+        """
+        result = {"caddy_api_stats": self.api_stats()}
+        if self.api_trace:
+            result["caddy_api_trace"] = self.calls
+        return result
+
+    def close(self):
+        """
+        Closes the connection to the Caddy API, if one is open
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def exit_json(self, **kwargs):
+        """
+        Closes the connection and exits the module, adding API statistics to the result.
+        If a profile_file is set, the timings of this module run are written to it.
+        """
+        kwargs.update(self.api_result())
+        self.close()
+        if self.timer is not None and self.profile_file:
+            write_profile(self.module, self.profile_file, self.timer, self)
+        self.module.exit_json(**kwargs)
 
     def config_load(self, config):
-        return self._make_request("load", "POST", data=config)
+        """
+        Replaces the entire configuration.
+        It is written to /config/ rather than to the /load endpoint, as Caddy ignores the If-Match precondition on /load.
+        """
+        return self.config_patch("", config, create_path=False)
+
+    def config_load_adapted(self, config, adapter="caddyfile"):
+        """
+        Loads a configuration in another format, such as a Caddyfile, letting Caddy convert it with the given adapter.
+        Only the /load endpoint can do that, so this write is never conditional.
+        """
+        return self._make_request("load", "POST", data=config, content_type="text/{adapter}".format(adapter=adapter))
+
+    def adapt(self, config, adapter="caddyfile"):
+        """
+        Converts a configuration in another format, such as a Caddyfile, to JSON without loading it.
+        Returns a tuple (config, warnings), where warnings is the list of warnings reported by the adapter.
+        """
+        result = self._make_request("adapt", "POST", data=config,
+                                    content_type="text/{adapter}".format(adapter=adapter))
+        return result.get("result"), result.get("warnings") or []
 
     def config_get(self, path):
-        res = self._make_request("config/{path}".format(path=path.lstrip('/')), return_error=True)
-        if res is not None and "status_code" in res:
-            if "invalid traversal path at" in res.get("error", False):
-                return None
-            else:
-                self.module.exit_json(msg="Error while getting configuration at {path}: {err}".format(
-                    path=path, err=res.get('error', '')))
-        return res
+        return self._resolve(path)[0]
+
+    def config_digest(self, path, canonical=False):
+        """
+        Returns the ConfigDigest of the configuration at path (None if absent).
+        The response is hashed while it is received instead of being held in memory.
+        If canonical is set, a CanonicalDigest using the normalizer of this server is returned instead,
+        which can be compared to the digest of a desired configuration with bounded memory use.
+        """
+        return self._resolve(path, digest=self._new_digest(path, canonical))[0]
+
+    def config_compare(self, path, config):
+        """
+        Compares config to the currently running configuration at path.
+        Caddy serializes its configuration deterministically, so the response is compared byte-wise
+        to the serialized config first and only parsed if that comparison fails.
+        Configurations that only differ in ways Caddy does not care about are equal, see ConfigNormalizer.
+
+        Returns:
+            tuple: (equal, current), where current is the configuration at path (None if absent)
+        """
+        return self._compare(path, config)
+
+    def id_get(self, obj_id, path=""):
+        """
+        Returns the configuration at path below the object tagged with the given @id (None if absent).
+        Objects are addressed through the /id/ endpoint, so their position in the config does not matter.
+        """
+        return self._resolve(path, obj_id=obj_id)[0]
+
+    def id_digest(self, obj_id, path="", canonical=False):
+        """
+        Returns the ConfigDigest of the configuration at path below the object with the given @id (None if absent),
+        see config_digest()
+        """
+        return self._resolve(path, digest=self._new_digest(path, canonical), obj_id=obj_id)[0]
+
+    def _new_digest(self, path, canonical):
+        return CanonicalDigest(self.normalizer, path) if canonical else ConfigDigest()
+
+    def id_compare(self, obj_id, path, config):
+        """
+        Compares config to the currently running configuration at path below the object with the given @id,
+        see config_compare()
+        """
+        return self._compare(path, config, obj_id=obj_id)
+
+    def _compare(self, path, config, obj_id=None):
+        current = self._resolve(path, raw=True, obj_id=obj_id)[0]
+        if current is None:
+            return config is None, None
+        if current == encode_config(config):
+            return True, config
+        current = json.loads(current)
+        return self.normalizer.equal(current, config, path), current
+
+    def retry_on_conflict(self, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) and returns its result.
+        If a write made by func is rejected because the config was changed concurrently,
+        func is called again, up to CONFLICT_RETRIES times in total.
+        func must therefore read the current config before writing to it.
+        """
+        for _ in range(CONFLICT_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except CaddyConflictError:
+                self._existing_segments.clear()
+                self._etag = None
+        self.module.fail_json(
+            msg="The Caddy configuration was modified concurrently, giving up after {n} attempts".format(
+                n=CONFLICT_RETRIES))
+        return None
 
     def config_put(self, path, config, create_path=True):
-        if create_path:
-            self._create_path(path)
-        return self._make_request("config/{path}".format(path=path.lstrip('/')), "PUT", data=config)
+        return self._write("PUT", path, config, create_path)
 
     def config_post(self, path, config, create_path=True):
-        if create_path:
-            self._create_path(path)
-        return self._make_request("config/{path}".format(path=path.lstrip('/')), "POST", data=config)
+        return self._write("POST", path, config, create_path)
 
     def config_patch(self, path, config, create_path=True):
-        if create_path:
-            self._create_path(path)
-        return self._make_request("config/{path}".format(path=path.lstrip('/')), "PATCH", data=config)
+        return self._write("PATCH", path, config, create_path)
 
     def config_delete(self, path):
-        return self._make_request("config/{path}".format(path=path.lstrip('/')), "DELETE")
+        return self._write("DELETE", path)
+
+    def id_put(self, obj_id, path, config, create_path=True):
+        return self._write("PUT", path, config, create_path, obj_id=obj_id)
+
+    def id_post(self, obj_id, path, config, create_path=True):
+        return self._write("POST", path, config, create_path, obj_id=obj_id)
+
+    def id_patch(self, obj_id, path, config, create_path=True):
+        return self._write("PATCH", path, config, create_path, obj_id=obj_id)
+
+    def id_delete(self, obj_id, path=""):
+        return self._write("DELETE", path, obj_id=obj_id)
+
+    def _write(self, method, path, config=None, create_path=False, obj_id=None):
+        """
+        Writes config to path with the given method.
+        If obj_id is set, path is relative to the object tagged with that @id.
+        """
+        if create_path and method in ("PUT", "POST"):
+            # POSTing to a missing key sets its value, so the config can be created together with its path
+            if self._create_path(path, config, obj_id=obj_id):
+                return None
+        elif create_path and method == "PATCH":
+            self._create_path(path, obj_id=obj_id)
+        if method == "PATCH" and obj_id is None and not split_path(path):
+            return self._replace_config(config)
+        return self._make_request(self._api_path(path, obj_id), method, data=config)
+
+    def _replace_config(self, config):
+        """
+        Replaces the entire configuration with a PATCH of /config/.
+        If the configuration was deleted before, Caddy only accepts it as a PUT, which is sent instead.
+        """
+        etag = self._etag
+        res = self._make_request(self._api_path(""), "PATCH", data=config, return_error=True)
+        if not self._is_error(res):
+            return res
+        if MISSING_ROOT_ERROR_RE.search(res.get("error", "")):
+            # The rejected request did not change anything, so the precondition still applies
+            self._etag = etag
+            return self._make_request(self._api_path(""), "PUT", data=config)
+        self.module.fail_json(msg="Error while replacing the configuration: {error}".format(error=res["error"]),
+                              url="{addr}/{path}".format(addr=self.addr, path=self._api_path("")), method="PATCH")
+        return None
+
+    @staticmethod
+    def _api_path(path, obj_id=None):
+        """
+        Returns the API path for a config path, relative to the config root or to the object with the given @id
+        """
+        if obj_id is None:
+            return "config/{path}".format(path=path.lstrip('/'))
+        path = path.strip("/")
+        if not path:
+            return "id/{obj_id}".format(obj_id=obj_id)
+        return "id/{obj_id}/{path}".format(obj_id=obj_id, path=path)
 
     # pylint: disable=inconsistent-return-statements
-    def _make_request(self, path, method="GET", data=None, return_error=False):
+    def _make_request(self, path, method="GET", data=None, return_error=False, raw=False, digest=None, content_type=None):
         """
         Makes a request to the Caddy API server and returns its content
         (None unless method is GET or an error occurred and return_error is True)
@@ -68,28 +490,82 @@ class CaddyServer(object):
         Data is a valid data type for the Caddy API.
         If return_error is set and an error occurs, the status code and error body will be returned.
         If False, the module will fail.
+        If raw is set, the unparsed response body of a successful request is returned.
+        If digest is given, the body of a successful response is fed into it instead of being returned.
+        If data is a ConfigFile, its content is streamed as the request body.
+        If content_type is given, data is a string that is sent as-is with that content type instead of as JSON.
+
+        The ETag of each GET response is kept and sent as If-Match precondition with the next write.
+        If Caddy rejects the write because the config changed in the meantime, CaddyConflictError is raised.
+
+        Each call is recorded in self.calls with its method, path, status, duration,
+        body sizes and whether it reused an open connection.
         """
         url = "{self.addr}/{path}".format(self=self, path=path)
 
+        if method not in ("GET", "POST", "PUT", "PATCH", "DELETE"):
+            self.module.fail_json(
+                msg="Invalid HTTP method for accessing the Caddy API: {method}".format(method=method))
+            return
+
+        bytes_sent, bytes_received, connections_opened = self.bytes_sent, self.bytes_received, self.connections_opened
+        headers = {"Accept": "application/json"}
+        if self._scheme == "unix":
+            # On unix sockets, Caddy only accepts an empty or loopback Host header
+            headers["Host"] = "127.0.0.1"
+        body = None
+        if isinstance(data, ConfigFile):
+            body = open(data.path, "rb")
+            headers["Content-Length"] = str(data.size())
+            headers["Content-Type"] = "application/json"
+            self.bytes_sent += data.size()
+        elif content_type is not None:
+            body = to_bytes(data)
+            headers["Content-Type"] = content_type
+            self.bytes_sent += len(body)
+        elif data is not None:
+            body = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+            self.bytes_sent += len(body)
+        if method != "GET" and path != "adapt":
+            # Any write may change which paths exist
+            self._existing_segments.clear()
+            # Only the first write after a read can be conditional, as it changes the config hash itself
+            if self._etag:
+                headers["If-Match"] = self._etag
+                self._etag = None
+
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.close()
+            self.module.fail_json(msg="Deadline exceeded before the request could be sent", url=url, method=method)
+            return
+
+        start = time.monotonic()
         try:
-            if method == "GET":
-                r = requests.get(url, timeout=self.timeout)
-            elif method == "POST":
-                r = requests.post(url, json=data, timeout=self.timeout)
-            elif method == "PUT":
-                r = requests.put(url, json=data, timeout=self.timeout)
-            elif method == "PATCH":
-                r = requests.patch(url, json=data, timeout=self.timeout)
-            elif method == "DELETE":
-                r = requests.delete(url, json=data, timeout=self.timeout)
-            else:
-                self.module.fail_json(
-                    msg="Invalid HTTP method for accessing the Caddy API: {method}".format(method=method))
-                return
-        except (requests.exceptions.RequestException, requests.ConnectionError) as e:
+            r = self._send(method, "{base}/{path}".format(base=self._base_path, path=path), body, headers,
+                           sink=digest.update if digest is not None else None)
+        except (HTTPException, socket.error, AnsibleConnectionError) as e:
+            self.close()
             self.module.fail_json(msg="Error accessing the Caddy API: {error}".format(
                 error=repr(e)), url=url, method=method)
             return
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        self.calls.append({
+            "method": method,
+            "path": path,
+            "status": r.status_code,
+            "duration_ms": round((time.monotonic() - start) * 1000, 3),
+            "bytes_sent": self.bytes_sent - bytes_sent,
+            "bytes_received": self.bytes_received - bytes_received,
+            "reused": self.connections_opened == connections_opened,
+        })
+        if method == "GET":
+            self._etag = r.headers.get("etag")
+
+        if r.status_code == 412 and "If-Match" in headers:
+            raise CaddyConflictError(url)
 
         if not r.ok:
             error = r.json()
@@ -101,34 +577,217 @@ class CaddyServer(object):
                 error["status_code"] = r.status_code
                 return error
 
+        if raw:
+            return r.content
         try:
-            json = r.json()
+            return r.json()
         except ValueError:
             return
-        return json
 
-    def _create_path(self, path):
+    def _request_timeout(self):
+        """
+        Returns the socket timeout for the next request: the configured timeout,
+        shortened to the time left until the deadline if there is one
+        """
+        if self.deadline is None:
+            return self.timeout
+        return min(self.timeout, max(self.deadline - time.monotonic(), 0.001))
+
+    def _connect(self):
         """
-        Recursively walks through a caddy config path and creates objects until the final path object can be created.
-        Does nothing if the first object in the path already exists.
-        Does not create the final object in the path
+        Opens a new connection to the Caddy API
+        """
+        timeout = self._request_timeout()
+        if self._scheme == "unix":
+            conn = UnixHTTPConnection(self._netloc, timeout=timeout)
+        elif self._scheme == "https":
+            conn = HTTPSConnection(self._netloc, timeout=timeout)
+        else:
+            conn = HTTPConnection(self._netloc, timeout=timeout)
+        conn.connect()
+        if self._scheme != "unix":
+            # Requests are small and answered immediately, don't let Nagle's algorithm delay them
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections_opened += 1
+        return conn
+
+    def _send(self, method, url, body, headers, sink=None):
+        """
+        Sends a single request over the keep-alive connection and reads the entire response.
+        If the connection was closed by Caddy while idle, the request is sent again over a new one.
+        body may be a file object, which is then streamed.
+        If sink is given, the body of a successful response is passed to it in chunks instead of being returned.
+
+        Returns:
+            CaddyResponse: The response to the request
+        """
+        self.request_count += 1
+        if self._httpapi is not None:
+            # The httpapi plugin keeps its own connection alive across requests and tasks
+            if hasattr(body, "read"):
+                body = body.read()
+            status_code, reason, response_headers, content, reused = self._httpapi.send_request(
+                to_text(body) if body is not None else None, path=url, method=method, headers=headers)
+            if not reused:
+                self.connections_opened += 1
+            content = to_bytes(content)
+            self.bytes_received += len(content)
+            if sink is not None and status_code < 400:
+                sink(content)
+                content = b""
+            return CaddyResponse(status_code, reason, response_headers, content)
+
+        reused = self._conn is not None
+        if not reused:
+            self._conn = self._connect()
+        elif self.deadline is not None:
+            # Also used if the connection has to reconnect by itself
+            self._conn.timeout = self._request_timeout()
+            if self._conn.sock is not None:
+                self._conn.sock.settimeout(self._conn.timeout)
+        try:
+            self._conn.request(method, url, body=body, headers=headers)
+            r = self._conn.getresponse()
+        except (HTTPException, socket.error):
+            self.close()
+            if not reused:
+                raise
+            self._conn = self._connect()
+            if hasattr(body, "seek"):
+                body.seek(0)
+            self._conn.request(method, url, body=body, headers=headers)
+            r = self._conn.getresponse()
+        if sink is not None and r.status < 400:
+            chunk = r.read(STREAM_CHUNK_SIZE)
+            while chunk:
+                self.bytes_received += len(chunk)
+                sink(chunk)
+                chunk = r.read(STREAM_CHUNK_SIZE)
+            content = b""
+        else:
+            content = r.read()
+            self.bytes_received += len(content)
+        if r.will_close:
+            self.close()
+        return CaddyResponse(r.status, r.reason, r.headers, content)
+
+    def _resolve(self, path, raw=False, digest=None, obj_id=None):
+        """
+        Fetches the configuration at path and determines how much of the path already exists.
+        Returns a tuple (config, existing), where config is the configuration at path (None if absent)
+        and existing is the number of leading path segments present in the config.
+        If raw is set, config is returned as the serialized response body instead.
+        If digest is given, the response is hashed into it and config is the digest.
+        If obj_id is set, path is relative to the object tagged with that @id.
+        If no such object exists, existing is -1.
+        The number of existing segments is remembered until the next write, so that
+        _create_path() does not need to query the API again.
+        """
+        segments = split_path(path)
+        res = self._make_request(self._api_path(path, obj_id), return_error=True,
+                                 raw=raw or digest is not None, digest=digest)
+        if digest is not None and not self._is_error(res):
+            try:
+                res = None if digest.is_null() else digest
+            except ValueError as e:
+                self.module.fail_json(msg="Invalid configuration received from the Caddy API at {path}: {err}".format(
+                    path=self._api_path(path, obj_id), err=str(e)))
+                return None, 0
+        elif raw and isinstance(res, bytes) and res.strip() == b"null":
+            res = None
+        config = res
+        if self._is_error(res):
+            config = None
+            error = res.get("error", "")
+            traversal_error = TRAVERSAL_ERROR_RE.search(error)
+            bounds_error = OUT_OF_BOUNDS_ERROR_RE.search(error)
+            if obj_id is not None and UNKNOWN_ID_ERROR_RE.search(error):
+                existing = -1
+            elif traversal_error:
+                # Caddy could not traverse the last segment in the error path, so its parent is missing
+                depth = self._error_path_depth(traversal_error.group(1), segments)
+                existing = None if depth is None else max(depth - 2, 0)
+            elif bounds_error:
+                # The array exists, but not the index
+                depth = self._error_path_depth(bounds_error.group(1), segments)
+                existing = None if depth is None else depth - 1
+            else:
+                self.module.exit_json(msg="Error while getting configuration at {path}: {err}".format(
+                    path=path, err=error))
+                return None, 0
+            if existing is None:
+                # Also the case for objects addressed by @id, as errors report the full config path
+                existing = self._find_existing(segments, obj_id)
+        elif res is None:
+            # Caddy returns null for a missing key if its parent exists
+            existing = max(len(segments) - 1, 0)
+        else:
+            existing = len(segments)
+        self._existing_segments[(obj_id, path)] = existing
+        return config, existing
+
+    @staticmethod
+    def _is_error(res):
+        return isinstance(res, dict) and "status_code" in res and "error" in res
+
+    @staticmethod
+    def _error_path_depth(error_path, segments):
+        """
+        Returns the number of config path segments in a path reported by a Caddy error message,
+        or None if the error path is not part of the requested path.
+        """
+        error_segments = split_path(error_path)
+        if error_segments[:1] == ["config"] and error_segments[1:] == segments[:len(error_segments) - 1]:
+            return len(error_segments) - 1
+        return None
+
+    def _find_existing(self, segments, obj_id=None):
+        """
+        Returns the number of leading segments that exist by querying each parent path, starting with the deepest
+        """
+        for depth in range(len(segments) - 1, 0, -1):
+            res = self._make_request(self._api_path("/".join(segments[:depth]), obj_id), return_error=True)
+            if res is not None and not self._is_error(res):
+                return depth
+        return 0
+
+    def _create_path(self, path, config=_ABSENT, obj_id=None):
+        """
+        Creates all missing objects along a caddy config path with a single request.
+        Does nothing if the parent of the final object in the path already exists.
         Path segments that are integers will be treated as array indices.
 
-        For example, if the provided path is apps/http/servers/example,
-        this will attempt to create apps, then apps/http, then apps/http/servers with content {}.
+        The deepest existing part of the path is taken from a previous config_get() call if possible,
+        otherwise it is determined by fetching the configuration at path once.
+        If config is given, it is pushed as the final object in the path together with the missing objects.
+        If obj_id is set, path is relative to the object tagged with that @id, which must exist.
+
+        For example, if the provided path is apps/http/servers/example and only apps exists,
+        this will PUT {"servers": {}} to apps/http.
 
         Args:
             path (str): The path to create
+            config: Optional content for the final object in the path
+            obj_id (str): Optional @id of the object that path is relative to
+
+        Returns:
+            bool: True if the path was created and config was pushed along with it
         """
-        segments = path.split("/")
-        if len(segments) == 0 or self.config_get(path) is not None:
-            return
+        segments = split_path(path)
+        existing = self._existing_segments.get((obj_id, path))
+        if existing is None:
+            existing = self._resolve(path, obj_id=obj_id)[1]
+        if existing < 0:
+            self.module.fail_json(msg="No object with @id '{obj_id}' exists in the Caddy configuration".format(
+                obj_id=obj_id))
+            return False
+        if isinstance(config, ConfigFile):
+            # The file is streamed as-is, so it can't be embedded in the objects along the path
+            config = _ABSENT
 
-        present = []
-        while len(segments) > 1:
-            current_path = "/".join(present) + "/" + segments[0]
-            if self.config_get(current_path) is None:
-                self.config_put("/".join(present) + "/" + segments[0],
-                                [] if segments[1].isdigit() else {}, create_path=False)
-            present.append(segments[0])
-            segments.pop(0)
+        missing = segments[existing:]
+        if len(missing) < 2:
+            return False
+        self._make_request(self._api_path("/".join(segments[:existing + 1]), obj_id), "PUT",
+                           data=build_path_skeleton(missing[1:], config))
+        return config is not _ABSENT
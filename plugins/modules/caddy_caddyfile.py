@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+---
+module: caddy_caddyfile
+author: Max Hösel (@maxhoesel)
+short_description: Load a Caddyfile into Caddy through its API
+version_added: '6.2.0'
+description: >
+  This module applies a Caddyfile (or a configuration in any other format Caddy has an adapter for)
+  to a running Caddy server through its admin API, without reloading or restarting the service.
+  The Caddyfile is first converted to JSON by Caddy's C(/adapt) endpoint and compared to the running configuration,
+  so that it is only loaded if the result differs.
+  As with M(maxhoesel.caddy.caddy_load), the configuration is only loaded if the running configuration
+  was not modified by someone else since it was read, otherwise the module re-reads it and tries again.
+  This does not apply if I(adapt) is disabled.
+notes:
+  - Check mode is supported.
+  - Diff mode is supported.
+  - Caddy must have its admin API enabled. If it was started from a Caddyfile, the API listens on C(localhost:2019)
+    unless the Caddyfile sets the C(admin) global option.
+options:
+  content:
+    description: >
+      Contents of the Caddyfile. Mutually exclusive with I(src).
+    type: str
+  src:
+    description: >
+      Path to the Caddyfile on the managed node, as an alternative to I(content).
+      Mutually exclusive with I(content).
+    type: path
+  adapter:
+    description: >
+      Name of the config adapter that converts the configuration to JSON, such as C(caddyfile) or C(nginx).
+      The adapter must be compiled into Caddy.
+    type: str
+    default: caddyfile
+  adapt:
+    description:
+      - Whether to convert the configuration with C(/adapt) and compare it to the running configuration before loading it.
+      - If disabled, the configuration is posted to C(/load) directly, saving two requests.
+        The module then always returns C(changed=True) (without I(changes)), as Caddy does not report
+        whether the configuration actually changed. Caddy itself still skips reloading an identical configuration.
+    type: bool
+    default: yes
+  force:
+    description: >
+        By default, this module only loads the configuration if it differs from the running one.
+        Set I(force=True) if you always want to load the configuration, even if no changes will be made.
+        Settings this will cause the module to always return C(changed=True)
+    type: bool
+    default: no
+
+extends_documentation_fragment:
+  - maxhoesel.caddy.caddy_connection_fragment
+  - maxhoesel.caddy.caddy_compare_fragment
+"""
+
+EXAMPLES = r"""
+- name: Apply a Caddyfile without reloading the service
+  maxhoesel.caddy.caddy_caddyfile:
+    content: |
+      localhost:80
+      respond "Hello, world!"
+
+- name: Apply the Caddyfile written by a previous task
+  maxhoesel.caddy.caddy_caddyfile:
+    src: /etc/caddy/Caddyfile
+  register: caddyfile_result
+
+- name: Show warnings of the Caddyfile adapter
+  ansible.builtin.debug:
+    var: caddyfile_result.adapt_warnings
+"""
+
+RETURN = r"""
+changes:
+  description: >
+    Structural differences between the previous configuration and the adapted Caddyfile.
+    Array items are matched by content, so that moved items are reported as such instead of as changes to every index.
+  returned: if I(adapt) is set
+  type: list
+  elements: dict
+  contains:
+    op:
+      description: Type of the change, one of C(add), C(remove), C(change) or C(move)
+      type: str
+    path:
+      description: Config path of the changed value. For removed array items, this is their previous index
+      type: str
+    before:
+      description: Previous value. Not returned for C(op=add)
+      type: raw
+    after:
+      description: New value. Not returned for C(op=remove)
+      type: raw
+    from:
+      description: Previous config path of a moved array item. Only returned for C(op=move)
+      type: str
+adapt_warnings:
+  description: Warnings reported by the adapter, such as unformatted Caddyfiles or deprecated directives
+  returned: if I(adapt) is set
+  type: list
+  elements: dict
+  contains:
+    file:
+      description: File in which the warning occurred
+      type: str
+    line:
+      description: Line number of the warning
+      type: int
+    directive:
+      description: Directive that caused the warning
+      type: str
+    message:
+      description: The warning itself
+      type: str
+caddy_api_stats:
+  description: Statistics about the requests made to the Caddy API during this module run
+  returned: always
+  type: dict
+  contains:
+    requests:
+      description: Number of API requests made
+      type: int
+    connections_opened:
+      description: Number of connections that were opened to the Caddy API
+      type: int
+    connections_reused:
+      description: Number of requests that reused an already open connection
+      type: int
+    bytes_sent:
+      description: Number of request body bytes sent to the Caddy API
+      type: int
+    bytes_received:
+      description: Number of response body bytes received from the Caddy API
+      type: int
+    duration_ms:
+      description: Total time spent on API requests, in milliseconds
+      type: float
+caddy_api_trace:
+  description: Every request made to the Caddy API during this module run, in order
+  returned: if I(api_trace) is set
+  type: list
+  elements: dict
+  contains:
+    method:
+      description: HTTP method of the request
+      type: str
+    path:
+      description: Path of the request, relative to the API root
+      type: str
+    status:
+      description: HTTP status code of the response
+      type: int
+    duration_ms:
+      description: Time from sending the request until the response was fully read, in milliseconds
+      type: float
+    bytes_sent:
+      description: Number of request body bytes sent
+      type: int
+    bytes_received:
+      description: Number of response body bytes received
+      type: int
+    reused:
+      description: Whether the request was sent over an already open connection
+      type: bool
+"""
+
+from ansible.module_utils.basic import AnsibleModule
+from ..module_utils.caddyserver import CaddyServer
+from ..module_utils.caddy_connection_argspec import caddyhost_argspec
+from ..module_utils.caddy_normalize import caddy_compare_argspec
+from ..module_utils.caddy_diff import diff_config, diff_output
+from ..module_utils.caddy_profile import PhaseTimer
+
+
+def read_caddyfile(module):
+    """
+    Returns the Caddyfile given in the content or src option
+    """
+    if module.params["content"] is not None:
+        return module.params["content"]
+    try:
+        with open(module.params["src"], "rb") as f:
+            return f.read().decode("utf-8")
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        module.fail_json(msg="Could not read {src}: {err}".format(src=module.params["src"], err=str(e)))
+        return None
+
+
+def load_caddyfile(module, server, config):
+    """
+    Loads the adapted configuration if it differs from the running one.
+    Returns a result dictionary for server.exit_json()
+    """
+    unchanged, current_config = server.config_compare("", config)
+    if unchanged and not module.params["force"]:
+        return {"changed": False, "changes": []}
+    changes = diff_config(current_config, config, normalizer=server.normalizer)
+    if not module.check_mode:
+        server.config_load(config)
+    result = {"changed": True, "changes": changes}
+    if module._diff:
+        result["diff"] = diff_output(current_config, config, changes=changes)
+    return result
+
+
+def run_module():
+    timer = PhaseTimer()
+    module_args = dict(
+        adapt=dict(type="bool", default=True),
+        adapter=dict(type="str", default="caddyfile"),
+        content=dict(type="str"),
+        force=dict(type="bool", default=False),
+        src=dict(type="path"),
+    )
+    module_args.update(caddyhost_argspec)
+    module_args.update(caddy_compare_argspec)
+    module = AnsibleModule(module_args, supports_check_mode=True,
+                           mutually_exclusive=[("content", "src")], required_one_of=[("content", "src")])
+    caddyfile = read_caddyfile(module)
+
+    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"], timer=timer)
+    if not module.params["adapt"]:
+        if not module.check_mode:
+            server.config_load_adapted(caddyfile, module.params["adapter"])
+        server.exit_json(changed=True)
+
+    config, warnings = server.adapt(caddyfile, module.params["adapter"])
+    result = server.retry_on_conflict(load_caddyfile, module, server, config)
+    result["adapt_warnings"] = warnings
+    server.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,13 @@ version_added: '0.1.0'
 description: >
   This modules can update the configuration stored at any valid path in the caddy config API.
   It is idempotent in that it will not change the config if no changes are present.
+  If only parts of an existing configuration changed, only the smallest object containing all changes is pushed.
+  Changes are only pushed if the configuration at I(path) was not modified by someone else since it was read,
+  otherwise the module re-reads the configuration and tries again.
   You can select between all update modes supported by Caddy
 notes:
   - Check mode is supported.
+  - Diff mode is supported.
 options:
   append:
     description: >
@@ -26,10 +30,21 @@ options:
       See the L(Caddy API Documentation, https://caddyserver.com/docs/api\#patch-configpath) for details.
     type: bool
     default: no
+  append_items:
+    description:
+      - List of items to append to the array at I(path), as an alternative to I(content).
+      - All items that are not part of the array yet are appended with a single request,
+        using the C(...) expansion of the Caddy API. Items that are already present are skipped,
+        so re-running the task does not duplicate them. If the array does not exist, it is created.
+      - Can only be used with I(state=present). Mutually exclusive with I(content), I(src), I(append) and I(key).
+    type: list
+    elements: raw
+    version_added: '6.2.0'
   create_path:
     description: >
       Whether to create the path pointing to the configuration if it doesn't exist yet.
       For example, if I(path=apps/http/servers/myservice) and C(apps/http/servers) does not exist yet, the required path entries will be created.
+      All missing path entries are created with a single request, together with I(content) where possible.
       Note that any digit path segments are treated as array indices.
     type: bool
     default: yes
@@ -40,7 +55,7 @@ options:
       - value
     description: >
       Content to push to the specified I(path). Must be a dict or list corresponding to the API JSON format.
-      Required if I(state=present).
+      Required if I(state=present), unless I(src) is set.
     type: raw
   force:
     description: >
@@ -49,14 +64,51 @@ options:
         Settings this will cause the module to always return C(changed=True)
     type: bool
     default: no
+  id:
+    description:
+      - Address the configuration through the object tagged with this C(@id) instead of the config root,
+        using the C(/id/) endpoint of the Caddy API. I(path) is then relative to that object.
+      - This way, objects deep inside the config such as a single route can be updated without knowing their position,
+        which keeps working when array indices shift.
+      - The object must already exist. When replacing the object itself, include its C(@id) in I(content),
+        otherwise the tag is removed.
+    type: str
+    version_added: '6.2.0'
+  key:
+    description:
+      - Manage a single item of the array at I(path) instead of the array itself, identified by its value at this config path.
+        The path is relative to each item, for example C(match/0/host) for routes or C(@id).
+      - If I(state=present), the first matching item is replaced by I(content), or I(content) is appended if no item matches.
+        If I(state=absent), the first matching item is removed.
+      - The array is fetched once to find the item, so that re-running the task never duplicates it
+        and no index needs to be known in advance. The index of the item is returned in I(index).
+      - Mutually exclusive with I(append) and I(src).
+    type: str
+    version_added: '6.2.0'
+  key_value:
+    description: >
+      Value of I(key) that identifies the item. Defaults to the value of I(key) in I(content).
+      Required if I(state=absent) and I(key) is set.
+    type: raw
+    version_added: '6.2.0'
   path:
     aliases:
       - name
     description: >
       Configuration path to which the configuration content will be pushed. Note that the path if is automatically
-      prefixed with C(config/). Example: C(apps/http/servers/myservice)
+      prefixed with C(config/). Example: C(apps/http/servers/myservice).
+      If I(id) is set, the path is relative to the object with that C(@id) and defaults to the object itself.
+      Required unless I(id) is set.
+    type: path
+  src:
+    description:
+      - Path to a JSON file on the managed node containing the content to push, as an alternative to I(content).
+        Use this for large configurations, for example together with M(ansible.builtin.template).
+      - The file is compared to the configuration at I(path) by parsing both into a canonical hash while they are read,
+        and streamed to Caddy as-is if they differ. Outside of diff mode, no I(changes) are returned.
+      - Mutually exclusive with I(content).
     type: path
-    required: yes
+    version_added: '6.2.0'
   state:
     description: >
       If C(present), the configuration content at I(path) will be created or updated.
@@ -67,7 +119,9 @@ options:
     default: present
     type: str
 
-extends_documentation_fragment: maxhoesel.caddy.caddy_connection_fragment
+extends_documentation_fragment:
+  - maxhoesel.caddy.caddy_connection_fragment
+  - maxhoesel.caddy.caddy_compare_fragment
 """
 
 EXAMPLES = r"""
@@ -82,88 +136,193 @@ EXAMPLES = r"""
           - handler: static_response
             body: Hello World!
 
+- name: Ensure HTTP server configuration from a file is present
+  maxhoesel.caddy.caddy_config:
+    path: apps/http/servers/myserver
+    src: /etc/caddy/myserver.json
+
+- name: Update the body of the route with the @id "hello", wherever it is located
+  maxhoesel.caddy.caddy_config:
+    id: hello
+    path: handle/0/body
+    content: Hello again!
+
+- name: Ensure multiple upstreams are part of a reverse proxy, using a single request
+  maxhoesel.caddy.caddy_config:
+    path: apps/http/servers/myserver/routes/0/handle/0/upstreams
+    append_items:
+      - dial: "10.0.0.1:8080"
+      - dial: "10.0.0.2:8080"
+      - dial: "10.0.0.3:8080"
+
+- name: Ensure the route for example.com is present, replacing it if it exists
+  maxhoesel.caddy.caddy_config:
+    path: apps/http/servers/myserver/routes
+    key: match/0/host
+    content:
+      match:
+        - host:
+            - example.com
+      handle:
+        - handler: static_response
+          body: Hello example.com!
+
+- name: Ensure the route for example.com is absent
+  maxhoesel.caddy.caddy_config:
+    path: apps/http/servers/myserver/routes
+    key: match/0/host
+    key_value:
+      - example.com
+    state: absent
+
 - name: Ensure HTTP server config is absent
   maxhoesel.caddy.caddy_config:
     path: apps/http/servers/myserver
     state: absent
 """
 
+RETURN = r"""
+changes:
+  description: >
+    Structural differences between the previous and the new configuration.
+    Array items are matched by content, so that moved items are reported as such instead of as changes to every index.
+  returned: unless I(src) is used outside of diff mode
+  type: list
+  elements: dict
+  contains:
+    op:
+      description: Type of the change, one of C(add), C(remove), C(change) or C(move)
+      type: str
+    path:
+      description: >
+        Config path of the changed value. For removed array items, this is their previous index.
+        Relative to the object with the given I(id) if set
+      type: str
+    before:
+      description: Previous value. Not returned for C(op=add)
+      type: raw
+    after:
+      description: New value. Not returned for C(op=remove)
+      type: raw
+    from:
+      description: Previous config path of a moved array item. Only returned for C(op=move)
+      type: str
+index:
+  description: >
+    Index of the array item that was created, updated or removed, or that already matched I(content).
+    None if I(state=absent) and no item matched
+  returned: if I(key) is set
+  type: int
+caddy_api_stats:
+  description: Statistics about the requests made to the Caddy API during this module run
+  returned: always
+  type: dict
+  contains:
+    requests:
+      description: Number of API requests made
+      type: int
+    connections_opened:
+      description: Number of connections that were opened to the Caddy API
+      type: int
+    connections_reused:
+      description: Number of requests that reused an already open connection
+      type: int
+    bytes_sent:
+      description: Number of request body bytes sent to the Caddy API
+      type: int
+      version_added: '6.2.0'
+    bytes_received:
+      description: Number of response body bytes received from the Caddy API
+      type: int
+      version_added: '6.2.0'
+    duration_ms:
+      description: Total time spent on API requests, in milliseconds
+      type: float
+      version_added: '6.2.0'
+caddy_api_trace:
+  description: Every request made to the Caddy API during this module run, in order
+  returned: if I(api_trace) is set
+  type: list
+  elements: dict
+  version_added: '6.2.0'
+  contains:
+    method:
+      description: HTTP method of the request
+      type: str
+    path:
+      description: Path of the request, relative to the API root
+      type: str
+    status:
+      description: HTTP status code of the response
+      type: int
+    duration_ms:
+      description: Time from sending the request until the response was fully read, in milliseconds
+      type: float
+    bytes_sent:
+      description: Number of request body bytes sent
+      type: int
+    bytes_received:
+      description: Number of response body bytes received
+      type: int
+    reused:
+      description: Whether the request was sent over an already open connection
+      type: bool
+"""
+
 from typing import Dict, cast
 
 from ansible.module_utils.basic import AnsibleModule
 from ..module_utils.caddyserver import CaddyServer
 from ..module_utils.caddy_connection_argspec import caddyhost_argspec
-
-
-def create_or_update_config(module, server):
-    """
-    Creates or updates the configuration at the given path.
-    Returns a result dictionary for module.exit_json()
-
-    If append is set, the POST method will be used, else, PATCH will be used.
-    POST will append to an array at path, while PATCH wil overwrite it.
-    If force is set, will always push the configuration, even if no change would be made.
-    """
-    path = module.params['path']
-    content = module.params["content"]
-
-    # We first test for an existing config object and create it right away if none is found
-    current_config = server.config_get(path)
-
-    if current_config != content or module.params["force"]:
-        if module.check_mode:
-            pass
-        elif module.params["append"] and path.split("/")[-1].isdigit():
-            # Insert at array index with PUT
-            server.config_put(path, content, create_path=module.params["create_path"])
-        elif module.params["append"]:
-            # Other appends, post
-            server.config_post(path, content, create_path=module.params["create_path"])
-        elif current_config:
-            server.config_patch(path, content, create_path=module.params["create_path"])
-        else:
-            # current config doesn't exist, create
-            server.config_put(path, content, create_path=module.params["create_path"])
-        return {"changed": True}
-    return {"changed": False}
-
-
-def delete_config(module, server):
-    """
-    Deletes the configuration at path if configuration is present.
-    If force is set, will always push the configuration, even if no change would be made.
-    """
-    path = module.params["path"]
-
-    current_config = server.config_get(path)
-    if current_config is None:
-        return {"changed": False}
-    elif not module.check_mode:
-        server.config_delete(path)
-    return {"changed": True}
+from ..module_utils.caddy_normalize import caddy_compare_argspec
+from ..module_utils.caddy_config_ops import (
+    IdConfig, append_config_items, content_from_params, create_or_update_config, delete_config, upsert_config
+)
+from ..module_utils.caddy_profile import PhaseTimer
 
 
 def run_module():
+    timer = PhaseTimer()
     module_args = dict(
         append=dict(type="bool", default=False),
+        append_items=dict(type="list", elements="raw"),
         content=dict(aliases=["config", "value"], type="raw"),
         create_path=dict(type="bool", default=True),
         force=dict(type="bool", default=False),
-        path=dict(type="path", aliases=["name"], required=True),
+        id=dict(type="str"),
+        key=dict(type="str", no_log=False),
+        key_value=dict(type="raw", no_log=False),
+        path=dict(type="path", aliases=["name"]),
+        src=dict(type="path"),
         state=dict(type="str", choices=["present", "absent"], default="present")
     )
     module_args.update(caddyhost_argspec)  # type: ignore
-    module = AnsibleModule(module_args, supports_check_mode=True)
+    module_args.update(caddy_compare_argspec)  # type: ignore
+    module = AnsibleModule(module_args, supports_check_mode=True,
+                           mutually_exclusive=[("content", "src"), ("key", "append"), ("key", "src"),
+                                               ("append_items", "content", "src", "append", "key")],
+                           required_one_of=[("path", "id")])
     module.params = cast(Dict, module.params)
+    params = dict(module.params, content=content_from_params(module), path=module.params["path"] or "")
 
-    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"])
+    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"], timer=timer)
+    # Objects addressed by @id are handled like a config of their own
+    target = IdConfig(server, module.params["id"]) if module.params["id"] else server
 
     result = {}
-    if module.params["state"] == "present":
-        result = create_or_update_config(module, server)
+    if module.params["append_items"] is not None:
+        result = server.retry_on_conflict(append_config_items, target, params, module.check_mode, module._diff)
+    elif module.params["key"]:
+        result = server.retry_on_conflict(upsert_config, target, params, module.check_mode, module._diff)
+    elif module.params["state"] == "present":
+        result = server.retry_on_conflict(create_or_update_config, target, params, module.check_mode, module._diff)
     elif module.params["state"] == "absent":
-        result = delete_config(module, server)
-    module.exit_json(**result)
+        result = server.retry_on_conflict(delete_config, target, params, module.check_mode, module._diff)
+    if module.params["id"] and "diff" in result:
+        for header in ("before_header", "after_header"):
+            result["diff"][header] = "id/{obj_id}{path}".format(
+                obj_id=module.params["id"], path=result["diff"][header][len("config"):])
+    server.exit_json(**result)
 
 
 def main():
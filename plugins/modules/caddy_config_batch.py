@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2021, Max Hösel <ansible@maxhoesel.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+---
+module: caddy_config_batch
+author: Max Hösel (@maxhoesel)
+short_description: Apply multiple configuration changes to different paths in the caddy config at once
+version_added: '6.2.0'
+description: >
+  This module applies a list of operations, each of which works like a single M(maxhoesel.caddy.caddy_config) task.
+  Instead of querying and updating Caddy once per operation, the configuration below the longest path
+  shared by the parents of all operation paths is fetched once and all operations are evaluated against it locally, in order.
+  The result is then pushed with a single request: the changed object itself if only one change is needed,
+  or the smallest object containing all changes otherwise.
+  The request is only accepted if the configuration was not modified by someone else since it was fetched,
+  otherwise the module fetches it again and re-evaluates the operations.
+  Use this instead of looping over M(maxhoesel.caddy.caddy_config) when managing many objects.
+notes:
+  - Check mode is supported.
+  - Diff mode is supported.
+  - Because all operations are pushed together, either all or none of them are applied.
+options:
+  operations:
+    description: >
+      List of operations to apply, in order. Each operation is evaluated against the result of the ones before it.
+    type: list
+    elements: dict
+    required: yes
+    suboptions:
+      append:
+        description: See the I(append) option of M(maxhoesel.caddy.caddy_config).
+        type: bool
+        default: no
+      content:
+        aliases:
+          - config
+          - value
+        description: >
+          Content to push to the specified I(path). Must be a dict or list corresponding to the API JSON format.
+          Required if I(state=present).
+        type: raw
+      create_path:
+        description: See the I(create_path) option of M(maxhoesel.caddy.caddy_config).
+        type: bool
+        default: yes
+      path:
+        aliases:
+          - name
+        description: >
+          Configuration path to which the configuration content will be pushed. Note that the path if is automatically
+          prefixed with C(config/). Example: C(apps/http/servers/myservice)
+        type: path
+        required: yes
+      state:
+        description: >
+          If C(present), the configuration content at I(path) will be created or updated.
+          If C(absent), any existing configuration at I(path) will be removed.
+        choices:
+          - present
+          - absent
+        default: present
+        type: str
+  force:
+    description: >
+        By default, this module only pushes configurations if changes have been made compared to the currently running config.
+        Set I(force=True) if you always want to push the configuration, even if no changes will be made.
+        Settings this will cause the module to always return C(changed=True)
+    type: bool
+    default: no
+
+extends_documentation_fragment:
+  - maxhoesel.caddy.caddy_connection_fragment
+  - maxhoesel.caddy.caddy_compare_fragment
+"""
+
+EXAMPLES = r"""
+- name: Ensure multiple HTTP servers are configured
+  maxhoesel.caddy.caddy_config_batch:
+    operations:
+      - path: apps/http/servers/first
+        content:
+          listen:
+            - ":2015"
+          routes:
+            - handle:
+              - handler: static_response
+                body: Hello World!
+      - path: apps/http/servers/second/listen
+        content: ":2016"
+        append: true
+      - path: apps/http/servers/old
+        state: absent
+
+- name: Remove multiple routes
+  maxhoesel.caddy.caddy_config_batch:
+    operations:
+      - path: apps/http/servers/first/routes/2
+        state: absent
+      - path: apps/http/servers/first/routes/1
+        state: absent
+"""
+
+RETURN = r"""
+changes:
+  description: >
+    Structural differences between the previous and the new configuration, for all operations combined.
+    Array items are matched by content, so that moved items are reported as such instead of as changes to every index.
+  returned: always
+  type: list
+  elements: dict
+  contains:
+    op:
+      description: Type of the change, one of C(add), C(remove), C(change) or C(move)
+      type: str
+    path:
+      description: Config path of the changed value. For removed array items, this is their previous index
+      type: str
+    before:
+      description: Previous value. Not returned for C(op=add)
+      type: raw
+    after:
+      description: New value. Not returned for C(op=remove)
+      type: raw
+    from:
+      description: Previous config path of a moved array item. Only returned for C(op=move)
+      type: str
+results:
+  description: Result of each operation, in the same order as I(operations)
+  returned: always
+  type: list
+  elements: dict
+  contains:
+    path:
+      description: Path of the operation
+      type: str
+    state:
+      description: State of the operation
+      type: str
+    changed:
+      description: Whether this operation changed the configuration
+      type: bool
+caddy_api_stats:
+  description: Statistics about the requests made to the Caddy API during this module run
+  returned: always
+  type: dict
+  contains:
+    requests:
+      description: Number of API requests made
+      type: int
+    connections_opened:
+      description: Number of connections that were opened to the Caddy API
+      type: int
+    connections_reused:
+      description: Number of requests that reused an already open connection
+      type: int
+    bytes_sent:
+      description: Number of request body bytes sent to the Caddy API
+      type: int
+      version_added: '6.2.0'
+    bytes_received:
+      description: Number of response body bytes received from the Caddy API
+      type: int
+      version_added: '6.2.0'
+    duration_ms:
+      description: Total time spent on API requests, in milliseconds
+      type: float
+      version_added: '6.2.0'
+caddy_api_trace:
+  description: Every request made to the Caddy API during this module run, in order
+  returned: if I(api_trace) is set
+  type: list
+  elements: dict
+  version_added: '6.2.0'
+  contains:
+    method:
+      description: HTTP method of the request
+      type: str
+    path:
+      description: Path of the request, relative to the API root
+      type: str
+    status:
+      description: HTTP status code of the response
+      type: int
+    duration_ms:
+      description: Time from sending the request until the response was fully read, in milliseconds
+      type: float
+    bytes_sent:
+      description: Number of request body bytes sent
+      type: int
+    bytes_received:
+      description: Number of response body bytes received
+      type: int
+    reused:
+      description: Whether the request was sent over an already open connection
+      type: bool
+"""
+
+from typing import Dict, cast
+
+from ansible.module_utils.basic import AnsibleModule
+from ..module_utils.caddyserver import CaddyServer, split_path
+from ..module_utils.caddy_connection_argspec import caddyhost_argspec
+from ..module_utils.caddy_normalize import caddy_compare_argspec
+from ..module_utils.caddy_config_ops import (
+    ConfigSnapshot, ConfigSnapshotError, common_path, create_or_update_config, delete_config
+)
+from ..module_utils.caddy_diff import apply_writes, diff_config, diff_output, plan_writes
+from ..module_utils.caddy_profile import PhaseTimer
+
+
+def evaluate_operations(module, snapshot):
+    """
+    Applies all operations to the snapshot.
+    Returns a list with the result of each operation.
+    """
+    results = []
+    for i, op in enumerate(module.params["operations"]):
+        params = dict(op, force=module.params["force"])
+        try:
+            if op["state"] == "present":
+                result = create_or_update_config(snapshot, params)
+            else:
+                result = delete_config(snapshot, params)
+        except ConfigSnapshotError as e:
+            module.fail_json(msg="Operation {i} on path '{path}' failed: {err}".format(
+                i=i, path=op["path"], err=str(e)))
+        results.append(dict(path=op["path"], state=op["state"], changed=result["changed"]))
+    return results
+
+
+def push_snapshot(server, snapshot, base_path):
+    """
+    Pushes the changes in the snapshot to Caddy with a single request
+    """
+    if not snapshot.requests:
+        return
+    if len(snapshot.requests) == 1 and snapshot.base_exists:
+        # A single targeted change, replay it as-is
+        apply_writes(server, snapshot.requests)
+    elif snapshot.base_exists and snapshot.config is not None:
+        apply_writes(server, plan_writes(snapshot.original, snapshot.config, base_path, normalizer=server.normalizer)
+                     or [("PATCH", base_path, snapshot.config)])
+    elif snapshot.config is None:
+        server.config_delete(base_path)
+    elif not snapshot.base:
+        server.config_load(snapshot.config)
+    else:
+        server.config_put(base_path, snapshot.config, create_path=True)
+
+
+def apply_batch(module, server):
+    """
+    Fetches the configuration shared by all operations, evaluates them and pushes the result.
+    Returns a result dictionary for server.exit_json()
+    """
+    # The snapshot must contain the parent of each path, so that array indices can be resolved like Caddy does
+    base_path = common_path(["/".join(split_path(op["path"])[:-1]) for op in module.params["operations"]])
+    snapshot = ConfigSnapshot(base_path, server.config_get(base_path), server.normalizer)
+
+    results = evaluate_operations(module, snapshot)
+    changed = any(result["changed"] for result in results)
+
+    if changed and not module.check_mode:
+        push_snapshot(server, snapshot, base_path)
+
+    changes = diff_config(snapshot.original, snapshot.config, base_path, server.normalizer)
+    result = {"changed": changed, "results": results, "changes": changes}
+    if changed and module._diff:
+        result["diff"] = diff_output(snapshot.original, snapshot.config, base_path, changes)
+    return result
+
+
+def run_module():
+    timer = PhaseTimer()
+    module_args = dict(
+        operations=dict(type="list", elements="dict", required=True, options=dict(
+            append=dict(type="bool", default=False),
+            content=dict(aliases=["config", "value"], type="raw"),
+            create_path=dict(type="bool", default=True),
+            path=dict(type="path", aliases=["name"], required=True),
+            state=dict(type="str", choices=["present", "absent"], default="present"),
+        )),
+        force=dict(type="bool", default=False),
+    )
+    module_args.update(caddyhost_argspec)  # type: ignore
+    module_args.update(caddy_compare_argspec)  # type: ignore
+    module = AnsibleModule(module_args, supports_check_mode=True)
+    module.params = cast(Dict, module.params)
+
+    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"], timer=timer)
+
+    result = server.retry_on_conflict(apply_batch, module, server)
+    server.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,73 @@ module: caddy_config_info
 author: Max Hösel (@maxhoesel)
 short_description: Get the current Caddy configuration for a given path
 version_added: '0.1.0'
-description: Returns the currently running configuration for any given path
+description: >
+  Returns the currently running configuration for any given path.
+  For large configurations, the result can be reduced to the parts that are actually needed
+  with I(fields) and I(depth), or replaced by a summary or hash with I(output).
+  This happens on the managed node, so that only the reduced result is sent back to the controller.
 notes:
+  - Check mode is supported.
 options:
+  depth:
+    description: >
+      Only return objects and arrays up to this many levels below I(path).
+      Deeper objects and arrays are replaced by their summary, see I(output=keys_only).
+      With C(0), only the summary of the configuration at I(path) is returned.
+      By default, the configuration is returned in full.
+    type: int
+    version_added: '6.2.0'
+  fields:
+    description:
+      - Only return these parts of the configuration, keeping their position below I(path).
+      - Each field is a config path relative to I(path), such as C(routes/0/handle).
+        A path segment of C(*) selects all items of an object or array, for example C(*/listen) with I(path=apps/http/servers)
+        returns the listen addresses of all servers.
+      - Array items keep their index. Items before a selected item that are not selected themselves are returned as C(null).
+      - Fields that don't exist are left out.
+    type: list
+    elements: str
+    version_added: '6.2.0'
+  id:
+    description:
+      - Read the configuration through the object tagged with this C(@id) instead of the config root,
+        using the C(/id/) endpoint of the Caddy API. I(path) and I(paths) are then relative to that object.
+      - Returns C(None) if no object with this C(@id) exists.
+    type: str
+    version_added: '6.2.0'
+  output:
+    description:
+      - How to return the configuration.
+      - C(config) returns the configuration itself in I(config).
+      - C(keys_only) returns a summary in I(summary) instead, containing the type of the configuration,
+        its number of items and, for objects, their keys.
+      - C(hash) returns a SHA-256 digest of the configuration in I(hash) instead, which changes whenever the configuration does.
+        The digest does not depend on key order or formatting, so it is the same with or without I(paths), I(fields) or I(depth)
+        for the same configuration. Without I(fields) or I(depth), it is computed while the configuration is received.
+    type: str
+    choices:
+      - config
+      - keys_only
+      - hash
+    default: config
+    version_added: '6.2.0'
   path:
     aliases:
       - name
     description: >
       Path from which the configuration content will be read. Note that C(config/) is automatically
       appended. Example: "apps/http/servers/myservice"
+      Exactly one of I(path) or I(paths) is required, unless I(id) is set, in which case the object itself is read by default.
     type: path
-    required: yes
+  paths:
+    description:
+      - List of paths from which the configuration content will be read, as an alternative to I(path).
+      - All paths are answered from a single request for the configuration at the longest path they have in common.
+        The results are returned as a dict keyed by path, with C(None) for paths that don't exist.
+      - I(fields), I(depth) and I(output) are applied to each path separately.
+    type: list
+    elements: path
+    version_added: '6.2.0'
 
 extends_documentation_fragment: maxhoesel.caddy.caddy_connection_fragment
 """
@@ -34,32 +90,206 @@ EXAMPLES = r"""
   register: myserver_cfg
 - debug:
     msg: "{{ myserver_cfg.config }}"
+
+- name: Get the names of all HTTP servers
+  maxhoesel.caddy.caddy_config_info:
+    path: apps/http/servers
+    output: keys_only
+  register: servers
+- debug:
+    msg: "{{ servers.summary.keys }}"
+
+- name: Get the listen addresses of all HTTP servers
+  maxhoesel.caddy.caddy_config_info:
+    path: apps/http/servers
+    fields:
+      - "*/listen"
+
+- name: Get multiple parts of the config at once
+  maxhoesel.caddy.caddy_config_info:
+    paths:
+      - apps/http/servers
+      - apps/tls/automation
+      - logging
+  register: parts
+- debug:
+    msg: "{{ parts.config['apps/tls/automation'] }}"
+
+- name: Get the route with the @id "hello", wherever it is located
+  maxhoesel.caddy.caddy_config_info:
+    id: hello
+  register: route
+
+- name: Check whether the config has changed since the last run
+  maxhoesel.caddy.caddy_config_info:
+    path: ""
+    output: hash
+  register: config_hash
 """
 
 RETURN = r"""
 config:
-  description: Configuration at the requested path as a mapping/list
-  returned: success
+  description: >
+    Configuration at the requested path as a mapping/list, reduced by I(fields) and I(depth).
+    If I(paths) is used, a dict containing the configuration of each path instead.
+  returned: if I(output=config)
+  type: dict
+summary:
+  description: >
+    Summary of the configuration at the requested path, reduced by I(fields) and I(depth). None if there is no configuration.
+    If I(paths) is used, a dict containing the summary of each path instead.
+  returned: if I(output=keys_only)
+  type: dict
+  contains:
+    type:
+      description: Type of the configuration, one of C(object), C(array), C(string), C(number) or C(boolean)
+      type: str
+    length:
+      description: Number of items in the object or array
+      type: int
+      returned: for objects and arrays
+    keys:
+      description: Keys of the object, sorted
+      type: list
+      elements: str
+      returned: for objects
+hash:
+  description: >
+    SHA-256 digest of the canonical form of the configuration at the requested path, reduced by I(fields) and I(depth).
+    None if there is no configuration.
+    If I(paths) is used, a dict containing the digest of each path instead.
+  returned: if I(output=hash)
+  type: raw
+caddy_api_stats:
+  description: Statistics about the requests made to the Caddy API during this module run
+  returned: always
   type: dict
+  contains:
+    requests:
+      description: Number of API requests made
+      type: int
+    connections_opened:
+      description: Number of connections that were opened to the Caddy API
+      type: int
+    connections_reused:
+      description: Number of requests that reused an already open connection
+      type: int
+    bytes_sent:
+      description: Number of request body bytes sent to the Caddy API
+      type: int
+      version_added: '6.2.0'
+    bytes_received:
+      description: Number of response body bytes received from the Caddy API
+      type: int
+      version_added: '6.2.0'
+    duration_ms:
+      description: Total time spent on API requests, in milliseconds
+      type: float
+      version_added: '6.2.0'
+caddy_api_trace:
+  description: Every request made to the Caddy API during this module run, in order
+  returned: if I(api_trace) is set
+  type: list
+  elements: dict
+  version_added: '6.2.0'
+  contains:
+    method:
+      description: HTTP method of the request
+      type: str
+    path:
+      description: Path of the request, relative to the API root
+      type: str
+    status:
+      description: HTTP status code of the response
+      type: int
+    duration_ms:
+      description: Time from sending the request until the response was fully read, in milliseconds
+      type: float
+    bytes_sent:
+      description: Number of request body bytes sent
+      type: int
+    bytes_received:
+      description: Number of response body bytes received
+      type: int
+    reused:
+      description: Whether the request was sent over an already open connection
+      type: bool
 """
 
 from ansible.module_utils.basic import AnsibleModule
 from ..module_utils.caddyserver import CaddyServer
 from ..module_utils.caddy_connection_argspec import caddyhost_argspec
+from ..module_utils.caddy_config_ops import ConfigSnapshot, IdConfig, common_path
+from ..module_utils.caddy_query import project_config, summarize_config, truncate_config
+from ..module_utils.caddy_normalize import ConfigNormalizer
+from ..module_utils.caddy_stream import canonical_digest
+from ..module_utils.caddy_profile import PhaseTimer
+
+# Result key for each output mode
+OUTPUT_KEYS = {"config": "config", "keys_only": "summary", "hash": "hash"}
+
+
+def reduce_config(module, config):
+    """
+    Reduces a configuration according to the fields, depth and output parameters
+    """
+    fields = module.params["fields"]
+    depth = module.params["depth"]
+    if config is not None and fields is not None:
+        config = project_config(config, fields)
+    if config is not None and depth is not None:
+        config = truncate_config(config, depth)
+
+    if module.params["output"] == "keys_only":
+        return summarize_config(config)
+    if module.params["output"] == "hash":
+        return canonical_digest(config).hexdigest() if config is not None else None
+    return config
+
+
+def get_config(module, server):
+    """
+    Fetches the configuration at path or paths and reduces it according to the module parameters.
+    Returns a result dictionary for server.exit_json()
+    """
+    key = OUTPUT_KEYS[module.params["output"]]
+    if module.params["id"]:
+        server = IdConfig(server, module.params["id"])
+
+    paths = module.params["paths"]
+    if paths is not None:
+        # Fetch everything at once and look up each path locally, following the same rules as Caddy
+        base_path = common_path(paths)
+        snapshot = ConfigSnapshot(base_path, server.config_get(base_path))
+        return {"changed": False, key: dict((path, reduce_config(module, snapshot.config_get(path))) for path in paths)}
+
+    path = module.params["path"] or ""
+    if key == "hash" and module.params["fields"] is None and module.params["depth"] is None:
+        # Nothing to reduce, so the response is hashed while it is received
+        digest = server.config_digest(path, canonical=True)
+        return {"changed": False, "hash": digest.hexdigest() if digest is not None else None}
+    return {"changed": False, key: reduce_config(module, server.config_get(path))}
 
 
 def run_module():
+    timer = PhaseTimer()
     module_args = dict(
-        path=dict(type="path", aliases=["name"], required=True),
+        depth=dict(type="int"),
+        fields=dict(type="list", elements="str"),
+        id=dict(type="str"),
+        output=dict(type="str", choices=["config", "keys_only", "hash"], default="config"),
+        path=dict(type="path", aliases=["name"]),
+        paths=dict(type="list", elements="path"),
     )
 
     module_args.update(caddyhost_argspec)
-    module = AnsibleModule(module_args, supports_check_mode=True)
-
-    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"])
-    config = server.config_get(module.params["path"])
+    module = AnsibleModule(module_args, supports_check_mode=True,
+                           required_one_of=[("path", "paths", "id")], mutually_exclusive=[("path", "paths")])
 
-    module.exit_json(changed=False, config=config)
+    # Hashes must change with any change to the configuration, so nothing is normalized away
+    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"], timer=timer,
+                         normalizer=ConfigNormalizer(normalize=False))
+    server.exit_json(**get_config(module, server))
 
 
 def main():
@@ -13,17 +13,75 @@ author: Max Hösel (@maxhoesel)
 short_description: Load a new configuration into Caddy
 version_added: '0.1.0'
 description: >
-  This module pushes a caddy configuration to the server via the C(/load)    API endpoint.
+  This module pushes a caddy configuration to the server via the C(/config/) API endpoint.
   If no change between the currently running and future configuration is found, no changes will be made.
+  If only parts of the configuration changed, only the smallest object containing all changes is pushed
+  instead of the entire configuration.
+  The new configuration is only loaded if the running configuration was not modified by someone else since it was read,
+  otherwise the module re-reads the configuration and tries again.
+  To push the same configuration to many Caddy servers at once, pass their API endpoints in I(caddy_hosts).
 notes:
   - Check mode is supported.
+  - Diff mode is supported.
 options:
+  caddy_hosts:
+    description:
+      - List of Caddy API endpoints to load the configuration into, in the same format as I(caddy_host).
+      - The configuration is pushed to all endpoints in parallel, see I(max_in_flight) and I(max_failures).
+        I(timeout) applies to each request made to a node, I(node_timeout) to all requests made to a node together.
+      - The module fails if the configuration could not be loaded into any of the endpoints.
+        The result of each endpoint is returned in I(nodes).
+      - This is usually combined with C(run_once) and C(delegate_to), as the module only needs to run on one host.
+      - Mutually exclusive with I(caddy_host).
+    type: list
+    elements: str
+    version_added: '6.2.0'
+  max_in_flight:
+    description: Maximum number of I(caddy_hosts) that are updated at the same time.
+    type: int
+    default: 10
+    version_added: '6.2.0'
+  max_failures:
+    description: >
+      Stop starting updates of further I(caddy_hosts) once this many have failed.
+      Updates that are already running are completed, the remaining endpoints are returned as skipped.
+      By default, all endpoints are updated regardless of failures.
+      Must be at least 1.
+    type: int
+    version_added: '6.2.0'
+  node_timeout:
+    description:
+      - Maximum time in seconds that updating a single one of the I(caddy_hosts) may take, including retries.
+      - The node fails if its next request would start after this time, and the timeout of each request is shortened
+        to the time that is left. As this is enforced per socket operation, large transfers may overrun it slightly.
+      - By default, only the I(timeout) of each request applies.
+    type: int
+    version_added: '6.2.0'
   content:
     aliases:
       - config
       - value
-    description: Configuration for caddy. Needs to be a mapping corresponding to the API JSON format.
+    description: >
+      Configuration for caddy. Needs to be a mapping corresponding to the API JSON format.
+      Mutually exclusive with I(src).
     type: raw
+  compare:
+    description:
+      - How to compare I(content) to the running configuration.
+      - C(full) fetches and parses the running configuration, so that only the parts that changed
+        need to be pushed and the I(changes) can be returned.
+      - C(hash) streams the running configuration through an incremental parser into a canonical hash
+        and compares it to the hash of I(content), so that memory use does not grow with the size of the running configuration.
+        If they differ, the entire configuration is loaded and no I(changes) are returned.
+        I(normalize), I(ignore_paths) and I(unordered_paths) apply to the hash as well.
+        Use this for very large configurations. In diff mode, C(full) is always used.
+      - Configurations from I(src) are always compared by their hash outside of diff mode.
+    type: str
+    choices:
+      - full
+      - hash
+    default: full
+    version_added: '6.2.0'
   force:
     description: >
         By default, this module only pushes configurations if changes have been made compared to the currently running config.
@@ -31,8 +89,19 @@ options:
         Settings this will cause the module to always return C(changed=True)
     type: bool
     default: no
+  src:
+    description:
+      - Path to a JSON file on the managed node containing the configuration, as an alternative to I(content).
+        Use this for large configurations, for example together with M(ansible.builtin.template).
+      - The file is compared to the running configuration by hashing both while they are read, see I(compare=hash),
+        and streamed to Caddy as-is if they differ. Outside of diff mode, no I(changes) are returned.
+      - Mutually exclusive with I(content).
+    type: path
+    version_added: '6.2.0'
 
-extends_documentation_fragment: maxhoesel.caddy.caddy_connection_fragment
+extends_documentation_fragment:
+  - maxhoesel.caddy.caddy_connection_fragment
+  - maxhoesel.caddy.caddy_compare_fragment
 """
 
 EXAMPLES = r"""
@@ -49,30 +118,245 @@ EXAMPLES = r"""
                 - handle:
                     - handler: "static_response"
                       body: "Hello, world!"
+
+- name: Roll out a config to all edge nodes, 5 at a time, stopping after 2 failures
+  maxhoesel.caddy.caddy_load:
+    content: "{{ edge_config }}"
+    caddy_hosts:
+      - http://edge1.example.com:2019
+      - http://edge2.example.com:2019
+      - http://edge3.example.com:2019
+    max_in_flight: 5
+    max_failures: 2
+  run_once: true
+  delegate_to: localhost
+
+- name: Load a large Caddy config from a file
+  maxhoesel.caddy.caddy_load:
+    src: /etc/caddy/caddy.json
+"""
+
+RETURN = r"""
+changes:
+  description: >
+    Structural differences between the previous and the new configuration.
+    Array items are matched by content, so that moved items are reported as such instead of as changes to every index.
+  returned: unless I(caddy_hosts) is set, or I(src) or I(compare=hash) is used outside of diff mode
+  type: list
+  elements: dict
+  contains:
+    op:
+      description: Type of the change, one of C(add), C(remove), C(change) or C(move)
+      type: str
+    path:
+      description: Config path of the changed value. For removed array items, this is their previous index
+      type: str
+    before:
+      description: Previous value. Not returned for C(op=add)
+      type: raw
+    after:
+      description: New value. Not returned for C(op=remove)
+      type: raw
+    from:
+      description: Previous config path of a moved array item. Only returned for C(op=move)
+      type: str
+nodes:
+  description: >
+    Result for each of the I(caddy_hosts), in the same order.
+    Each result also contains the I(changes), I(caddy_api_stats) and I(caddy_api_trace) of that node,
+    unless it failed or was skipped.
+  returned: if I(caddy_hosts) is set
+  type: list
+  elements: dict
+  contains:
+    caddy_host:
+      description: API endpoint of the node
+      type: str
+    changed:
+      description: Whether the configuration of the node was changed
+      type: bool
+    failed:
+      description: Whether loading the configuration into the node failed
+      type: bool
+    skipped:
+      description: Set if the node was not updated because I(max_failures) was reached
+      type: bool
+    msg:
+      description: Error message, if the node failed or was skipped
+      type: str
+caddy_api_stats:
+  description: Statistics about the requests made to the Caddy API during this module run
+  returned: unless I(caddy_hosts) is set
+  type: dict
+  contains:
+    requests:
+      description: Number of API requests made
+      type: int
+    connections_opened:
+      description: Number of connections that were opened to the Caddy API
+      type: int
+    connections_reused:
+      description: Number of requests that reused an already open connection
+      type: int
+    bytes_sent:
+      description: Number of request body bytes sent to the Caddy API
+      type: int
+      version_added: '6.2.0'
+    bytes_received:
+      description: Number of response body bytes received from the Caddy API
+      type: int
+      version_added: '6.2.0'
+    duration_ms:
+      description: Total time spent on API requests, in milliseconds
+      type: float
+      version_added: '6.2.0'
+caddy_api_trace:
+  description: Every request made to the Caddy API during this module run, in order
+  returned: if I(api_trace) is set, unless I(caddy_hosts) is set
+  type: list
+  elements: dict
+  version_added: '6.2.0'
+  contains:
+    method:
+      description: HTTP method of the request
+      type: str
+    path:
+      description: Path of the request, relative to the API root
+      type: str
+    status:
+      description: HTTP status code of the response
+      type: int
+    duration_ms:
+      description: Time from sending the request until the response was fully read, in milliseconds
+      type: float
+    bytes_sent:
+      description: Number of request body bytes sent
+      type: int
+    bytes_received:
+      description: Number of response body bytes received
+      type: int
+    reused:
+      description: Whether the request was sent over an already open connection
+      type: bool
 """
 
 
 from ansible.module_utils.basic import AnsibleModule
-from ..module_utils.caddyserver import CaddyServer
+from ..module_utils.caddyserver import CaddyServer, ConfigFile
 from ..module_utils.caddy_connection_argspec import caddyhost_argspec
+from ..module_utils.caddy_normalize import caddy_compare_argspec
+from ..module_utils.caddy_diff import apply_writes, diff_config, diff_output, plan_writes
+from ..module_utils.caddy_config_ops import content_from_params
+from ..module_utils.caddy_fleet import caddy_fleet_argspec, run_on_fleet
+from ..module_utils.caddy_stream import canonical_digest
+from ..module_utils.caddy_profile import PhaseTimer
+
+
+def load_config(module, server, content):
+    """
+    Loads the configuration into Caddy if it differs from the running one.
+    content is the configuration to load, or a ConfigFile containing it.
+    Returns a result dictionary for server.exit_json()
+    """
+    if isinstance(content, ConfigFile) or (module.params["compare"] == "hash" and not module._diff):
+        return load_config_hashed(module, server, content)
+    unchanged, current_config = server.config_compare("", content)
+    if not unchanged or module.params["force"]:
+        changes = diff_config(current_config, content, normalizer=server.normalizer)
+        if module.check_mode:
+            pass
+        elif current_config is None or module.params["force"]:
+            server.config_load(content)
+        else:
+            apply_writes(server, plan_writes(current_config, content, normalizer=server.normalizer))
+
+        result = {"changed": True, "changes": changes}
+        if module._diff:
+            result["diff"] = diff_output(current_config, content, changes=changes)
+        return result
+    return {"changed": False, "changes": []}
+
+
+def load_config_hashed(module, server, content):
+    """
+    Loads the configuration if its canonical hash differs from the one of the running configuration.
+    The running configuration is hashed while it is received, so that it is never held in memory.
+    content is the configuration to load, or a ConfigFile containing it, which is hashed while it is read.
+    Returns a result dictionary for server.exit_json()
+    """
+    if isinstance(content, ConfigFile):
+        try:
+            digest = content.digest(server.normalizer)
+        except (OSError, ValueError) as e:
+            module.fail_json(msg="Could not read configuration from {src}: {err}".format(src=content.path, err=str(e)))
+            return None
+    else:
+        digest = canonical_digest(content, server.normalizer)
+
+    if server.config_digest("", canonical=True) == digest and not module.params["force"]:
+        return {"changed": False}
+    if not module.check_mode:
+        server.config_load(content)
+    return {"changed": True}
+
+
+def load_fleet_config(module, content):
+    """
+    Loads the configuration into all caddy_hosts in parallel and exits the module
+    """
+    if module.params["max_in_flight"] < 1:
+        module.fail_json(msg="max_in_flight must be at least 1")
+    if module.params["max_failures"] is not None and module.params["max_failures"] < 1:
+        module.fail_json(msg="max_failures must be at least 1")
+    if module.params["node_timeout"] is not None and module.params["node_timeout"] < 1:
+        module.fail_json(msg="node_timeout must be at least 1")
+
+    nodes = run_on_fleet(
+        module, module.params["caddy_hosts"],
+        lambda node, server: server.retry_on_conflict(load_config, node, server, content),
+        max_in_flight=module.params["max_in_flight"], max_failures=module.params["max_failures"])
+
+    result = {"changed": any(node["changed"] for node in nodes), "nodes": nodes}
+    diffs = []
+    for node in nodes:
+        if "diff" in node:
+            diff = node.pop("diff")
+            for header in ("before_header", "after_header"):
+                diff[header] = "{host}: {header}".format(host=node["caddy_host"], header=diff[header])
+            diffs.append(diff)
+    if diffs:
+        result["diff"] = diffs
+
+    failed = len([node for node in nodes if node["failed"]])
+    if failed:
+        skipped = len([node for node in nodes if node.get("skipped")])
+        module.fail_json(msg="Failed to load the configuration into {n} of {total} nodes ({skipped} skipped)".format(
+            n=failed, total=len(nodes), skipped=skipped), **result)
+    module.exit_json(**result)
 
 
 def run_module():
+    timer = PhaseTimer()
     module_args = dict(
         content=dict(aliases=["config", "value"], type="raw"),
+        compare=dict(type="str", choices=["full", "hash"], default="full"),
         force=dict(type="bool", default=False),
+        src=dict(type="path"),
     )
     module_args.update(caddyhost_argspec)
-    module = AnsibleModule(module_args, supports_check_mode=True)
+    module_args.update(caddy_compare_argspec)
+    module_args.update(caddy_fleet_argspec)
+    module = AnsibleModule(module_args, supports_check_mode=True,
+                           mutually_exclusive=[("caddy_host", "caddy_hosts"), ("content", "src")])
+    content = content_from_params(module)
+
+    if module.params["caddy_hosts"]:
+        load_fleet_config(module, content)
 
-    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"])
+    server = CaddyServer(module, module.params["caddy_host"], timeout=module.params["timeout"], timer=timer)
 
-    current_config = server.config_get("")
-    if current_config != module.params["content"] or module.params["force"]:
-        if not module.check_mode:
-            server.config_load(module.params["content"])
-        module.exit_json(changed=True)
-    module.exit_json(changed=False)
+    result = server.retry_on_conflict(load_config, module, server, content)
+    server.exit_json(**result)
 
 
 def main():
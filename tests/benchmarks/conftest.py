@@ -0,0 +1,358 @@
+# pylint: disable=redefined-outer-name
+import functools
+import hashlib
+import json
+import socketserver
+import threading
+import time
+from collections.abc import Generator
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+
+BENCHMARK_CONFIG = {
+    "apps": {
+        "http": {
+            "servers": {
+                f"srv{i}": {"listen": [f":{8000 + i}"], "routes": [{"handle": [{"handler": "static_response"}]}]}
+                for i in range(20)
+            }
+        }
+    }
+}
+
+# Number of routes per server in generated configs
+ROUTES_PER_SERVER = 1000
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --run-benchmarks")
+    for item in items:
+        item.add_marker(skip)
+
+
+def _route(server: int, route: int) -> dict:
+    return {
+        "@id": f"route-{server}-{route}",
+        "match": [{"host": [f"site{route}.srv{server}.example.com"]}],
+        "handle": [{
+            "handler": "reverse_proxy",
+            "upstreams": [{"dial": f"10.{server % 256}.{route // 256 % 256}.{route % 256}:8080"}],
+        }],
+        "terminal": True,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def generate_config(size: int) -> bytes:
+    """
+    Returns the JSON serialization of a config with about size bytes.
+    It consists of servers with up to ROUTES_PER_SERVER reverse proxy routes each, every route having an @id.
+    Cached, as generating the largest configs takes a while. Parse the result to get a config that can be modified.
+    """
+    route_size = len(json.dumps(_route(0, 0), separators=(",", ":")))
+    routes = max(size // route_size, 1)
+    servers = {}
+    for server in range((routes - 1) // ROUTES_PER_SERVER + 1):
+        count = min(routes - server * ROUTES_PER_SERVER, ROUTES_PER_SERVER)
+        servers[f"srv{server}"] = {
+            "listen": [f":{8000 + server}"],
+            "routes": [_route(server, route) for route in range(count)],
+        }
+    return json.dumps({"apps": {"http": {"servers": servers}}}, separators=(",", ":")).encode()
+
+
+class APIError(Exception):
+    def __init__(self, status: int, msg: str):
+        super().__init__(msg)
+        self.status = status
+
+
+def _encode(value: Any) -> bytes:
+    # Like Go's encoder, Caddy escapes HTML characters and terminates responses with a newline
+    data = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return (data.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026") + "\n").encode()
+
+
+@dataclass
+class FakeAdminAPI:
+    """
+    In-process stand-in for the Caddy admin API, following the semantics of Caddy's admin.go:
+
+    - GET/POST/PUT/PATCH/DELETE on /config/<path>, including array indices and "..." expansion for POST
+    - /id/<id>/<path> for objects with an @id
+    - POST /load to replace the entire config
+    - ETag headers on GET and If-Match preconditions on writes to /config, answered with 412 on mismatch.
+      Like Caddy, /load ignores If-Match.
+
+    Each request is delayed by latency seconds, to simulate a remote or busy Caddy instance.
+    """
+    url: str
+    config: Any = None
+    latency: float = 0.0
+    requests: list = field(default_factory=list)
+    # Config path of each @id. Like Caddy, this is updated whenever the config changes, not when it is used
+    _ids: dict = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def reset(self, config: Any = None, latency: float = 0.0):
+        with self._lock:
+            self.config = config
+            self.latency = latency
+            self.requests = []
+            self._index_ids()
+
+    def handle(self, method: str, path: str, body: bytes, if_match: Optional[str]) -> tuple:
+        """Returns (status, body, headers) of the response"""
+        with self._lock:
+            self.requests.append((method, path))
+            try:
+                if path.startswith("/id/"):
+                    path = self._expand_id(path)
+                if path == "/load":
+                    if method != "POST":
+                        raise APIError(405, "method not allowed")
+                    self.config = json.loads(body)
+                    self._index_ids()
+                    return 200, b"", {}
+                if not path.startswith("/config"):
+                    raise APIError(404, "not found")
+                if method == "GET":
+                    data = self._access("GET", path)
+                    return 200, data, {
+                        "Content-Type": "application/json",
+                        "Etag": f'"{path} {hashlib.sha1(data).hexdigest()}"',
+                    }
+                self._check_precondition(if_match)
+                self._access(method, path, json.loads(body) if body else None)
+                self._index_ids()
+                return 200, b"", {}
+            except APIError as e:
+                return e.status, json.dumps({"error": str(e)}).encode(), {"Content-Type": "application/json"}
+
+    def _check_precondition(self, if_match: Optional[str]):
+        if not if_match:
+            return
+        path, expected = if_match.strip('"').split(" ", 1)
+        try:
+            data = self._access("GET", path)
+        except APIError:
+            data = b""
+        if hashlib.sha1(data).hexdigest() != expected:
+            raise APIError(412, "If-Match header did not match current config hash")
+
+    def _expand_id(self, path: str) -> str:
+        obj_id, _, rest = path[len("/id/"):].partition("/")
+        if obj_id not in self._ids:
+            raise APIError(404, f"unknown object ID '{obj_id}'")
+        return self._ids[obj_id] + ("/" + rest if rest else "")
+
+    def _index_ids(self):
+        self._ids = {}
+        stack = [(self.config, "/config")]
+        while stack:
+            value, path = stack.pop()
+            if isinstance(value, dict):
+                if "@id" in value:
+                    self._ids[value["@id"]] = path
+                stack.extend((item, f"{path}/{key}") for key, item in value.items())
+            elif isinstance(value, list):
+                stack.extend((item, f"{path}/{i}") for i, item in enumerate(value))
+
+    # pylint: disable=too-many-branches
+    def _access(self, method: str, path: str, value: Any = None) -> bytes:
+        root = {"config": self.config}
+        parts = path.strip("/").split("/")
+        expand = parts[-1] == "..."
+        if expand:
+            parts = parts[:-1]
+            if not isinstance(value, list):
+                raise APIError(400, "the '...' expansion requires an array")
+        ptr: Any = root
+        try:
+            for i, part in enumerate(parts):
+                if isinstance(ptr, dict):
+                    array = ptr.get(part)
+                    if isinstance(array, list) and i == len(parts) - 2:
+                        return self._access_array(method, path, array, parts[-1], value)
+                    if i == len(parts) - 1:
+                        return self._access_key(method, path, ptr, part, value, expand)
+                    if ptr.get(part) is None and method == "PUT":
+                        # Caddy creates missing objects along the path of a PUT
+                        ptr[part] = {}
+                    ptr = ptr.get(part)
+                elif isinstance(ptr, list):
+                    index = self._index(path, part)
+                    if index >= len(ptr):
+                        raise APIError(400, f"[/{'/'.join(parts[:i + 1])}] array index out of bounds: {part}")
+                    if i == len(parts) - 1:
+                        return self._access_array(method, path, ptr, part, value)
+                    ptr = ptr[index]
+                else:
+                    raise APIError(400, f"invalid traversal path at: {'/'.join(parts[:i + 1])}")
+            return b""
+        finally:
+            self.config = root.get("config")
+
+    @staticmethod
+    def _index(path: str, part: str) -> int:
+        if not part.isdigit():
+            raise APIError(400, f"[{path}] invalid array index '{part}'")
+        return int(part)
+
+    def _access_array(self, method: str, path: str, array: list, part: str, value: Any) -> bytes:
+        if method == "POST":
+            if isinstance(value, list) and path.endswith("/..."):
+                array.extend(value)
+            else:
+                array.append(value)
+            return b""
+        index = self._index(path, part)
+        if index > len(array) or (method != "PUT" and index == len(array)):
+            raise APIError(400, f"[{path}] array index out of bounds: {part}")
+        if method == "GET":
+            return _encode(array[index])
+        if method == "PUT":
+            array.insert(index, value)
+        elif method == "PATCH":
+            array[index] = value
+        elif method == "DELETE":
+            del array[index]
+        return b""
+
+    @staticmethod
+    def _access_key(method: str, path: str, obj: dict, key: str, value: Any, expand: bool) -> bytes:
+        if method == "GET":
+            return _encode(obj.get(key))
+        if method == "POST":
+            if isinstance(obj.get(key), list):
+                if expand:
+                    obj[key].extend(value)
+                else:
+                    obj[key].append(value)
+            else:
+                obj[key] = value
+        elif method == "PUT":
+            if key in obj:
+                raise APIError(409, f"[{path}] key already exists: {key}")
+            obj[key] = value
+        elif method in ("PATCH", "DELETE"):
+            if key not in obj:
+                raise APIError(404, f"[{path}] key does not exist: {key}")
+            if method == "PATCH":
+                obj[key] = value
+            else:
+                del obj[key]
+        return b""
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def _make_handler(api: FakeAdminAPI, tcp: bool = True):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Like Caddy (Go), send responses right away instead of waiting for delayed ACKs
+        disable_nagle_algorithm = tcp
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+        def _handle(self):
+            if api.latency:
+                time.sleep(api.latency)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, data, headers = api.handle(self.command, self.path, body, self.headers.get("If-Match"))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    return Handler
+
+
+def _serve(server) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.fixture(scope="session")
+def fake_admin_api() -> Generator[FakeAdminAPI, None, None]:
+    api = FakeAdminAPI(url="", config=BENCHMARK_CONFIG)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(api))
+    api.url = f"http://127.0.0.1:{server.server_address[1]}"
+    _serve(server)
+    yield api
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def fake_admin_socket(tmp_path_factory) -> Generator[FakeAdminAPI, None, None]:
+    socket_path = Path(tmp_path_factory.mktemp("caddy"), "admin.sock")
+    api = FakeAdminAPI(url=f"unix://{socket_path}", config=BENCHMARK_CONFIG)
+    server = _UnixHTTPServer(str(socket_path), _make_handler(api, tcp=False))
+    _serve(server)
+    yield api
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def _caddy_api_server() -> Generator[FakeAdminAPI, None, None]:
+    api = FakeAdminAPI(url="")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(api))
+    api.url = f"http://127.0.0.1:{server.server_address[1]}"
+    _serve(server)
+    yield api
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def caddy_api(_caddy_api_server) -> FakeAdminAPI:
+    """A fake admin API with an empty config and no latency, for benchmarks that modify the config"""
+    _caddy_api_server.reset()
+    return _caddy_api_server
+
+
+@dataclass
+class BenchmarkReport:
+    """Collects the measurements of all benchmarks, to be printed and optionally saved at the end of the session"""
+    results: list = field(default_factory=list)
+
+    def add(self, **result):
+        self.results.append(result)
+
+
+@pytest.fixture(scope="session")
+def benchmark_report(request) -> Generator[BenchmarkReport, None, None]:
+    report = BenchmarkReport()
+    yield report
+    if not report.results:
+        return
+    columns = list(dict.fromkeys(key for result in report.results for key in result))
+    widths = {col: max(len(col), *(len(str(result.get(col, ""))) for result in report.results)) for col in columns}
+    lines = ["  ".join(col.ljust(widths[col]) for col in columns)]
+    lines += ["  ".join(str(result.get(col, "")).ljust(widths[col]) for col in columns) for result in report.results]
+    print("\n" + "\n".join(lines))
+    output = request.config.getoption("--benchmark-output")
+    if output:
+        Path(output).write_text(json.dumps(report.results, indent=2) + "\n", encoding="utf-8")
@@ -0,0 +1,83 @@
+"""Compares the built-in Caddy API client against the previous requests-based implementation"""
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+from plugins.module_utils.caddyserver import CaddyServer
+
+STARTUP_RUNS = 10
+CALLS = 300
+
+
+class FakeModule:
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs)
+
+    def exit_json(self, **kwargs):
+        raise AssertionError(kwargs)
+
+
+def _startup_time(code: str) -> float:
+    """Best wall time of a fresh interpreter executing code, in seconds"""
+    times = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _per_call(func) -> float:
+    """Median latency of func, in seconds"""
+    times = []
+    for _ in range(CALLS):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def test_client_startup():
+    pytest.importorskip("requests")
+    # Every module imports AnsibleModule, so only the time on top of that counts
+    module = "import ansible.module_utils.basic"
+    baseline = _startup_time(module)
+    old = _startup_time(f"{module}; import json, requests; from requests.adapters import HTTPAdapter")
+    new = _startup_time(f"{module}; import plugins.module_utils.caddyserver")
+    print(f"\nstartup: AnsibleModule {baseline * 1000:.1f}ms, "
+          f"requests +{(old - baseline) * 1000:.1f}ms, http.client +{(new - baseline) * 1000:.1f}ms")
+    assert new < old
+
+
+def test_client_call_latency(fake_admin_api):
+    requests = pytest.importorskip("requests")
+
+    session = requests.Session()
+    old = _per_call(lambda: session.get(f"{fake_admin_api.url}/config/", timeout=30).json())
+    session.close()
+
+    server = CaddyServer(FakeModule(), fake_admin_api.url, timeout=30)
+    new = _per_call(lambda: server.config_get(""))
+    stats = server.api_stats()
+    server.close()
+
+    print(f"\nper call (median of {CALLS}): requests {old * 1e6:.0f}us, http.client {new * 1e6:.0f}us")
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == CALLS - 1
+
+
+def test_client_unix_socket_latency(fake_admin_api, fake_admin_socket):
+    tcp_server = CaddyServer(FakeModule(), fake_admin_api.url, timeout=30)
+    tcp = _per_call(lambda: tcp_server.config_get(""))
+    tcp_server.close()
+
+    unix_server = CaddyServer(FakeModule(), fake_admin_socket.url, timeout=30)
+    unix = _per_call(lambda: unix_server.config_get(""))
+    stats = unix_server.api_stats()
+    unix_server.close()
+
+    print(f"\nper call (median of {CALLS}): tcp {tcp * 1e6:.0f}us, unix socket {unix * 1e6:.0f}us")
+    assert stats["connections_opened"] == 1
@@ -0,0 +1,190 @@
+"""
+Measures round trips, wall time and peak memory of complete module runs against the fake Caddy admin API,
+across config sizes and path depths.
+
+Each module runs in a fresh interpreter, like it would when executed by Ansible.
+Run with --benchmark-output to save the results for comparing them between releases.
+"""
+import json
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from .conftest import FakeAdminAPI, generate_config
+
+ROOT = Path(__file__).resolve().parents[2]
+
+SIZES = {
+    "1KB": 1_000,
+    "100KB": 100_000,
+    "1MB": 1_000_000,
+    "10MB": 10_000_000,
+    "50MB": 50_000_000,
+}
+
+# Paths of increasing depth that exist in every generated config
+DEPTH_PATHS = {
+    1: "apps",
+    4: "apps/http/servers/srv0",
+    6: "apps/http/servers/srv0/routes/0",
+    10: "apps/http/servers/srv0/routes/0/handle/0/upstreams/0",
+}
+DIAL_PATH = "apps/http/servers/srv0/routes/0/handle/0/upstreams/0/dial"
+
+LATENCIES = [0.0, 0.01, 0.05]
+
+# Peak memory that caddy_load may use with src, regardless of the config size
+SRC_MEMORY_LIMIT = 64 * 2 ** 20
+
+# Runs a module like Ansible does and writes the peak memory of the process to a file when it exits.
+# ru_maxrss can't be used for this, as a spawned process inherits the peak of the benchmark process.
+_RUNNER = """
+import atexit, runpy, sys
+
+def report_peak(path):
+    with open("/proc/self/status") as f:
+        peak = next(line.split()[1] for line in f if line.startswith("VmHWM:"))
+    with open(path, "w") as f:
+        f.write(peak)
+
+module, peak_file = sys.argv[1:3]
+sys.argv = sys.argv[:1] + sys.argv[3:]
+atexit.register(report_peak, peak_file)
+runpy.run_module(module, run_name="__main__", alter_sys=True)
+"""
+
+
+@dataclass
+class ModuleRun:
+    result: dict
+    # Seconds from starting the interpreter until the module exited
+    wall: float
+    # Peak resident memory of the module process in bytes, None if it can't be determined on this platform
+    max_rss: Optional[int]
+    # Duration of each module phase in seconds, as written to the profile_file
+    phases: dict
+    # Requests that the fake API received during the run
+    api_requests: list
+
+
+def run_module(api: FakeAdminAPI, tmp_path: Path, name: str, **args) -> ModuleRun:
+    profile = tmp_path / "profile.jsonl"
+    peak = tmp_path / "peak"
+    args_file = tmp_path / "args.json"
+    args_file.write_text(json.dumps({"ANSIBLE_MODULE_ARGS": {
+        "caddy_host": api.url, "profile_file": str(profile), **args,
+    }}), encoding="utf-8")
+    api.requests.clear()
+
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", _RUNNER, f"plugins.modules.{name}", str(peak), str(args_file)],
+                          cwd=ROOT, capture_output=True, check=False)
+    wall = time.perf_counter() - start
+
+    assert proc.stdout, proc.stderr.decode()
+    result = json.loads(proc.stdout)
+    assert not result.get("failed"), result.get("msg")
+    phases = json.loads(profile.read_text(encoding="utf-8").splitlines()[-1])["phases"]
+    profile.unlink()
+    # VmHWM is given in kilobytes
+    max_rss = int(peak.read_text(encoding="utf-8")) * 1024 if peak.exists() else None
+    return ModuleRun(result, wall, max_rss, phases, list(api.requests))
+
+
+def _record(report, module: str, case: str, size: str, run: ModuleRun, **extra):
+    stats = run.result["caddy_api_stats"]
+    report.add(
+        module=module, case=case, size=size, **extra,
+        requests=stats["requests"],
+        wall_ms=round(run.wall * 1000, 1),
+        fetch_ms=round(run.phases["fetch"] * 1000, 1),
+        compare_ms=round(run.phases["compare"] * 1000, 1),
+        write_ms=round(run.phases["write"] * 1000, 1),
+        max_rss_mb=round(run.max_rss / 2 ** 20, 1) if run.max_rss is not None else None,
+        received_kb=round(stats["bytes_received"] / 1024, 1),
+        sent_kb=round(stats["bytes_sent"] / 1024, 1),
+    )
+
+
+def _load(api: FakeAdminAPI, size: str) -> dict:
+    api.reset(json.loads(generate_config(SIZES[size])))
+    return api.config
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("depth", DEPTH_PATHS)
+def test_caddy_config_info(caddy_api, benchmark_report, tmp_path, size, depth):
+    _load(caddy_api, size)
+    run = run_module(caddy_api, tmp_path, "caddy_config_info", path=DEPTH_PATHS[depth])
+    _record(benchmark_report, "caddy_config_info", "get", size, run, depth=depth)
+    assert run.result["config"] is not None
+    assert len(run.api_requests) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_caddy_config_info_hash(caddy_api, benchmark_report, tmp_path, size):
+    _load(caddy_api, size)
+    run = run_module(caddy_api, tmp_path, "caddy_config_info", path="", output="hash")
+    _record(benchmark_report, "caddy_config_info", "hash", size, run, depth=0)
+    assert len(run.api_requests) == 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("case", ["unchanged", "update", "create", "id", "append"])
+def test_caddy_config(caddy_api, benchmark_report, tmp_path, size, case):
+    config = _load(caddy_api, size)
+    dial = config["apps"]["http"]["servers"]["srv0"]["routes"][0]["handle"][0]["upstreams"][0]["dial"]
+    args = {
+        "unchanged": {"path": DIAL_PATH, "content": dial},
+        "update": {"path": DIAL_PATH, "content": "127.0.0.1:9000"},
+        "create": {"path": "apps/http/servers/srv0/routes/0/handle/0/headers/request/set/X-Benchmark",
+                   "content": ["1"]},
+        "id": {"id": "route-0-0", "path": "handle/0/upstreams/0/dial", "content": "127.0.0.1:9000"},
+        "append": {"path": "apps/http/servers/srv0/listen", "append_items": [":9000", ":9001"]},
+    }[case]
+    run = run_module(caddy_api, tmp_path, "caddy_config", **args)
+    _record(benchmark_report, "caddy_config", case, size, run, depth=len(args["path"].split("/")))
+    assert run.result["changed"] == (case != "unchanged")
+    # Every case needs a single read, and at most one write
+    assert len(run.api_requests) <= 2
+
+
+@pytest.mark.parametrize("latency", LATENCIES)
+def test_caddy_config_latency(caddy_api, benchmark_report, tmp_path, latency):
+    caddy_api.reset({"apps": {}}, latency=latency)
+    run = run_module(caddy_api, tmp_path, "caddy_config",
+                     path="apps/http/servers/srv0/routes/0/handle/0/headers/request/set/X-Benchmark",
+                     content=["1"], create_path=True)
+    _record(benchmark_report, "caddy_config", "create", "1KB", run, latency_ms=latency * 1000)
+    assert run.result["changed"]
+    assert run.wall >= len(run.api_requests) * latency
+    # Creating the path must not cost one round trip per missing segment
+    assert len(run.api_requests) <= 3
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("case", ["full-unchanged", "hash-unchanged", "src-unchanged", "full-changed", "src-changed"])
+def test_caddy_load(caddy_api, benchmark_report, tmp_path, size, case):
+    _load(caddy_api, size)
+    config = json.loads(generate_config(SIZES[size]))
+    if case.endswith("-changed"):
+        config["apps"]["http"]["servers"]["srv0"]["listen"] = [":9000"]
+    mode = case.split("-")[0]
+    if mode == "src":
+        src = tmp_path / "caddy.json"
+        src.write_text(json.dumps(config), encoding="utf-8")
+        args = {"src": str(src)}
+    else:
+        args = {"content": config, "compare": mode}
+    run = run_module(caddy_api, tmp_path, "caddy_load", **args)
+    _record(benchmark_report, "caddy_load", case, size, run)
+    assert run.result["changed"] == case.endswith("-changed")
+    assert len(run.api_requests) <= 2
+    if mode == "src" and run.max_rss is not None:
+        # Both the file and the running config are streamed instead of being loaded into memory
+        assert run.max_rss < SRC_MEMORY_LIMIT
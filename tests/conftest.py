@@ -115,3 +115,16 @@ def pytest_addoption(parser):
         default=False,
         help="Do not destroy molecule containers after running a scenario. Useful for debugging"
     )
+    parser.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        default=False,
+        help="Run the performance benchmarks in tests/benchmarks"
+    )
+    parser.addoption(
+        "--benchmark-output",
+        action="store",
+        default=None,
+        help="Write the results of the benchmarks in tests/benchmarks to this file as JSON, "
+        "for comparing them between releases"
+    )
@@ -0,0 +1,132 @@
+"""Tests of the httpapi plugin, using mocked HTTP connections"""
+# pylint: disable=redefined-outer-name
+from http.client import RemoteDisconnected
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("ansible_collections.ansible.netcommon.plugins.plugin_utils.httpapi_base")
+
+# pylint: disable=wrong-import-position
+from ansible.errors import AnsibleConnectionFailure
+
+from plugins.httpapi import caddy
+
+
+class FakeResponse:
+    def __init__(self, status=200, reason="OK", body=b"", headers=None, will_close=False):
+        self.status = status
+        self.reason = reason
+        self.will_close = will_close
+        self._body = body
+        self._headers = headers or {}
+
+    def read(self):
+        return self._body
+
+    def getheaders(self):
+        return list(self._headers.items())
+
+
+class FakeConnection:
+    """Stand-in for the httpapi connection plugin, which only provides options"""
+    _url = "http://caddy:2019"
+
+    def __init__(self, **options):
+        self.options = {"host": "caddy", "port": 2019, "use_ssl": False, "validate_certs": True,
+                        "persistent_command_timeout": 30}
+        self.options.update(options)
+
+    def get_option(self, name):
+        return self.options.get(name)
+
+
+@pytest.fixture
+def http_connection():
+    """Patches HTTPConnection in the plugin. Each opened connection answers with the responses queued on the mock."""
+    opened = []
+
+    def connect(*args, **kwargs):
+        conn = mock.Mock(args=args, kwargs=kwargs)
+        conn.getresponse.side_effect = http_connection.responses.pop(0) if http_connection.responses else None
+        opened.append(conn)
+        return conn
+
+    http_connection = mock.Mock(side_effect=connect, opened=opened, responses=[])
+    with mock.patch.object(caddy, "HTTPConnection", http_connection):
+        yield http_connection
+
+
+def test_connection_is_reused(http_connection):
+    http_connection.responses = [[FakeResponse(body=b"{}", headers={"Etag": '"/config/ abc"'}), FakeResponse()]]
+    plugin = caddy.HttpApi(FakeConnection())
+
+    first = plugin.send_request(None, path="/config/")
+    second = plugin.send_request('{"a": 1}', path="/config/", method="PATCH", headers={"If-Match": '"/config/ abc"'})
+
+    assert first == (200, "OK", {"etag": '"/config/ abc"'}, "{}", False)
+    assert second == (200, "OK", {}, "", True)
+    assert len(http_connection.opened) == 1
+    conn = http_connection.opened[0]
+    assert conn.args == ("caddy", 2019)
+    assert conn.kwargs == {"timeout": 30}
+    conn.request.assert_called_with("PATCH", "/config/", body=b'{"a": 1}', headers={"If-Match": '"/config/ abc"'})
+
+
+def test_error_status_is_returned(http_connection):
+    http_connection.responses = [[FakeResponse(400, "Bad Request", b'{"error": "invalid traversal path at: x"}')]]
+    plugin = caddy.HttpApi(FakeConnection())
+
+    assert plugin.send_request(None, path="/config/x") == (
+        400, "Bad Request", {}, '{"error": "invalid traversal path at: x"}', False)
+
+
+def test_reconnects_if_closed_while_idle(http_connection):
+    http_connection.responses = [[FakeResponse(), RemoteDisconnected("closed")], [FakeResponse(body=b"null")]]
+    plugin = caddy.HttpApi(FakeConnection())
+
+    plugin.send_request(None, path="/config/")
+    result = plugin.send_request(None, path="/config/")
+
+    assert result == (200, "OK", {}, "null", False)
+    assert len(http_connection.opened) == 2
+    http_connection.opened[0].close.assert_called_once()
+
+
+def test_connection_closed_by_server(http_connection):
+    http_connection.responses = [[FakeResponse(will_close=True)], [FakeResponse()]]
+    plugin = caddy.HttpApi(FakeConnection())
+
+    plugin.send_request(None, path="/config/")
+    result = plugin.send_request(None, path="/config/")
+
+    assert result[4] is False
+    assert len(http_connection.opened) == 2
+
+
+def test_connection_failure(http_connection):
+    http_connection.side_effect = ConnectionRefusedError("refused")
+    plugin = caddy.HttpApi(FakeConnection())
+
+    with pytest.raises(AnsibleConnectionFailure, match="Could not send request to http://caddy:2019/config/: refused"):
+        plugin.send_request(None, path="/config/")
+
+
+def test_failure_on_new_connection_is_not_retried(http_connection):
+    http_connection.responses = [[RemoteDisconnected("closed")]]
+    plugin = caddy.HttpApi(FakeConnection())
+
+    with pytest.raises(AnsibleConnectionFailure):
+        plugin.send_request(None, path="/config/")
+    assert len(http_connection.opened) == 1
+
+
+def test_https():
+    plugin = caddy.HttpApi(FakeConnection(use_ssl=True, validate_certs=False, port=None))
+    with mock.patch.object(caddy, "HTTPSConnection") as https_connection:
+        https_connection.return_value.getresponse.return_value = FakeResponse()
+        plugin.send_request(None, path="/config/")
+
+    (host, port), kwargs = https_connection.call_args
+    assert (host, port) == ("caddy", None)
+    assert kwargs["context"].verify_mode == caddy.ssl.CERT_NONE